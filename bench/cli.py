@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""End-to-end scaling of StagPy sub commands
+
+Synthetic runs (see synthetic.py) with an increasing number of snapshots
+are generated, then each sub command is run on them in a fresh
+interpreter, over the whole -s range.  Commands accepting a number of
+worker processes (plates -j) are run with each of the requested counts.
+Wall time, frames per second and peak memory are recorded in a json file
+and compared to a stored baseline:
+
+    python3 bench/cli.py [--snaps 4 16 ...] [--jobs 1 2 4] [-o out.json]
+    python3 bench/cli.py --update-baseline
+
+The exit status is 1 if a command fails (unless it also failed in the
+baseline) or is slower (or takes more memory) than the baseline by more
+than the tolerance.  The baseline should be recorded on a machine with
+several cores, otherwise it says nothing about the scaling with -j.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+
+BASELINE = os.path.join(BENCH_DIR, 'cli_baseline.json')
+CPUS = os.cpu_count() or 1
+# options of each sub command, and whether it takes a number of jobs
+COMMANDS = {
+    'field': (['-o', 't'], False),
+    'rprof': ([], False),
+    'time': ([], False),
+    'plates': ([], True),
+}
+
+
+def run(cmd, run_dir, work_dir, timeout):
+    """run a stagpy command in work_dir
+
+    Return the exit status, the wall time, the peak resident memory in
+    bytes (largest of the command and its worker processes) and the last
+    error message.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, (ROOT, env.get('PYTHONPATH'))))
+    env.setdefault('MPLBACKEND', 'Agg')
+    err_file = os.path.join(work_dir, 'stderr')
+    with open(err_file, 'w') as err, open(os.devnull, 'w') as out:
+        tic = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'stagpy'] + cmd + ['-p', run_dir],
+            cwd=work_dir, env=env, stdout=out, stderr=err)
+        # a timer rather than Popen.wait so that os.wait4 reaps the process
+        killer = threading.Timer(timeout, proc.kill)
+        killer.start()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - tic
+        killer.cancel()
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    with open(err_file) as err:
+        lines = [line for line in err.read().splitlines()
+                 if 'Error' in line or 'ERROR' in line] or ['']
+    # kilobytes on Linux, bytes on macOS
+    peak = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return proc.returncode, wall, peak, lines[-1].strip()
+
+
+def bench_run(path, nsnaps, args):
+    """time all the sub commands on a run of nsnaps snapshots"""
+    run_dir = os.path.join(path, 'run')
+    os.makedirs(run_dir)
+    synthetic.write_run(run_dir, nph=args.nph, nr=args.nr, nsnaps=nsnaps,
+                        nsteps=args.steps_per_snap * nsnaps)
+    results = []
+    for name in args.cmd:
+        opts, parallel = COMMANDS[name]
+        for jobs in args.jobs if parallel else [1]:
+            cmd = [name, '-n', 'bench', '-s', '0:{}:1'.format(nsnaps - 1)]
+            cmd += opts
+            if parallel:
+                cmd += ['-j', str(jobs)]
+            # fresh working directory, some commands write in it
+            work_dir = tempfile.mkdtemp(dir=path)
+            status, wall, peak, err = run(cmd, run_dir, work_dir,
+                                          args.timeout)
+            shutil.rmtree(work_dir)
+            res = {'cmd': name, 'snaps': nsnaps, 'nph': args.nph,
+                   'nr': args.nr, 'jobs': jobs, 'status': status,
+                   'wall': wall, 'fps': nsnaps / wall, 'peak_rss': peak}
+            if status:
+                res['error'] = err
+            results.append(res)
+            print_result(res)
+    shutil.rmtree(run_dir)
+    return results
+
+
+def key(res):
+    """identify a benchmark to compare it with the baseline"""
+    return '{cmd} snaps={snaps} grid={nph}x{nr} jobs={jobs}'.format(**res)
+
+
+def compare(results, baseline, tol):
+    """list of regressions with respect to baseline"""
+    ref = {key(res): res for res in baseline['results']}
+    regressions = []
+    for res in results:
+        old = ref.get(key(res))
+        if res['status']:
+            if old is None or not old['status']:
+                regressions.append('{}: failed ({})'.format(key(res),
+                                                             res['error']))
+            continue
+        if old is None or old['status']:
+            continue
+        for field in ('wall', 'peak_rss'):
+            ratio = res[field] / old[field]
+            if ratio > 1 + tol:
+                regressions.append('{}: {} x{:.2f}'.format(key(res), field,
+                                                           ratio))
+    return regressions
+
+
+def print_result(res):
+    """one line of the results table"""
+    status = 'ok' if not res['status'] else 'FAILED'
+    print('{:<8}{:>7}{:>12}{:>6}{:>10.2f}{:>9.2f}{:>10.1f}{:>8}'.format(
+        res['cmd'], res['snaps'], '{}x{}'.format(res['nph'], res['nr']),
+        res['jobs'], res['wall'], res['fps'], res['peak_rss'] / 2.**20,
+        status))
+
+
+def main():
+    """benchmark entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cmd', nargs='+', default=list(COMMANDS),
+                        choices=list(COMMANDS), help='sub commands to time')
+    parser.add_argument('--snaps', type=int, nargs='+', default=[4, 16, 64],
+                        help='numbers of snapshots of the generated runs')
+    parser.add_argument('--jobs', type=int, nargs='+',
+                        default=sorted({1, min(2, CPUS), CPUS}),
+                        help='numbers of worker processes')
+    parser.add_argument('--nph', type=int, default=1024)
+    parser.add_argument('--nr', type=int, default=64)
+    parser.add_argument('--steps-per-snap', type=int, default=10,
+                        help='steps in rprof.dat and time.dat per snapshot')
+    parser.add_argument('--timeout', type=float, default=3600.,
+                        help='time limit of each command in seconds')
+    parser.add_argument('-o', '--output', default='cli_results.json',
+                        help='json file receiving the results')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='json file of reference results')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store results as the new baseline')
+    parser.add_argument('--tol', type=float, default=0.2,
+                        help='tolerated relative slowdown')
+    args = parser.parse_args()
+
+    print('{:<8}{:>7}{:>12}{:>6}{:>10}{:>9}{:>10}{:>8}'.format(
+        'cmd', 'snaps', 'grid', 'jobs', 'wall s', 'fps', 'rss MB',
+        'status'))
+    results = []
+    with tempfile.TemporaryDirectory() as path:
+        for nsnaps in args.snaps:
+            results.extend(bench_run(path, nsnaps, args))
+    data = {'python': platform.python_version(),
+            'machine': platform.node(),
+            'cpus': CPUS,
+            'results': results}
+    with open(args.output, 'w') as fid:
+        json.dump(data, fid, indent=1)
+    if max(args.jobs) > CPUS:
+        print('more worker processes than the {} cores, the scaling with '
+              '-j is not measured'.format(CPUS))
+    if args.update_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        if CPUS < 2:
+            print('baseline recorded on a single core, record it again on '
+                  'a machine with several cores')
+        return
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as fid:
+            baseline = json.load(fid)
+        if baseline.get('machine') != data['machine']:
+            print('baseline recorded on {}'.format(baseline.get('machine')))
+        if baseline.get('cpus', 1) < 2:
+            print('baseline recorded on a single core, it does not cover '
+                  'the scaling with -j')
+    else:
+        print('no baseline, store one with --update-baseline')
+        baseline = {'results': []}
+    regressions = compare(results, baseline, args.tol)
+    for reg in regressions:
+        print(reg)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Throughput and memory of the StagPy readers
+
+Synthetic runs (see synthetic.py) of increasing grid size and number of
+steps are written in a temporary directory, then BinData, RprofData,
+TimeData and the plates detection are timed on them.  Memory is the peak
+of allocations traced by tracemalloc during the call.
+
+    python3 bench/readers.py [--nph 512 2048 ...] [--steps 100 1000 ...]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic  # noqa: E402
+from stagpy import parfile  # noqa: E402
+from stagpy.stagdata import BinData, RprofData, TimeData  # noqa: E402
+
+
+def measure(func, repeat):
+    """best wall time and peak traced memory of func()"""
+    best = np.inf
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - tic)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def make_args(path, nsteps=None):
+    """minimal namespace needed by the readers"""
+    args = argparse.Namespace(path=path, name='test', geometry='annulus')
+    args.par_nml = {sec: dict(opts) for sec, opts in
+                    parfile.PAR_DEFAULT.items()}
+    if nsteps is not None:
+        args.timestep = [0, nsteps, 1]
+    return args
+
+
+def bench_grid(path, nph, nr, repeat, magic, bits, decomp):
+    """time BinData and plates detection on one grid size"""
+    from stagpy.plates import detect_plates
+    synthetic.write_run(path, nph=nph, nr=nr, nsnaps=1, nsteps=2,
+                        magic=magic, bits=bits, decomp=decomp)
+    args = make_args(path)
+    results = []
+    for var in ('t', 'v'):
+        fname = os.path.join(path, 'test_{}00000'.format(
+            'vp' if var == 'v' else var))
+        size = os.path.getsize(fname)
+        wall, peak, _ = measure(lambda: BinData(args, var, 0), repeat)
+        results.append({'bench': 'BinData_' + var, 'nph': nph, 'nr': nr,
+                        'wall': wall, 'peak': peak, 'bytes': size})
+    velocity = BinData(args, 'v', 0)
+    age = BinData(args, 'a', 0)
+    wall, peak, out = measure(
+        lambda: detect_plates(args, velocity, age, 1., io.StringIO(), 0, 0.),
+        repeat)
+    # each plate boundary of the synthetic run is detected once
+    if len(out[0]) != synthetic.NPLATES // 2 or \
+            len(out[1]) != synthetic.NPLATES // 2:
+        raise RuntimeError('{} trenches and {} ridges found on {}x{}, {} '
+                           'of each expected'.format(
+                               len(out[0]), len(out[1]), nph, nr,
+                               synthetic.NPLATES // 2))
+    results.append({'bench': 'detect_plates', 'nph': nph, 'nr': nr,
+                    'wall': wall, 'peak': peak, 'ntrenches': len(out[0]),
+                    'nridges': len(out[1])})
+    return results
+
+
+def check_energy_budget(tol=0.05):
+    """check the energy budget of the sample run in data/
+
+    Layers must have positive thicknesses adding up to the whole domain,
+    and the change of heat content of the domain must match the heat
+    flowing through its boundaries, within tol times that heat flow.
+    Raise RuntimeError otherwise.
+    """
+    args = make_args(os.path.join(os.path.dirname(BENCH_DIR), 'data'))
+    args.timestep = [0, -1, 1]
+    rprof_data = RprofData(args)
+    heat, storage, zgrid = rprof_data.energy_budget()
+    thick = np.diff(zgrid)
+    if np.any(thick <= 0) or not np.isclose(thick.sum(), 1):
+        raise RuntimeError('invalid layers of energy budget: {}'.format(
+            zgrid))
+    qtot = rprof_data.energy()[0]
+    time = rprof_data.tsteps[:, 2]
+    boundary = np.abs(qtot[:, [0, -1]]).sum(axis=1)
+    scale = np.sum((boundary[1:] + boundary[:-1]) * np.diff(time) / 2)
+    residual = abs(heat.sum() - storage.sum())
+    if residual > tol * scale:
+        raise RuntimeError('energy budget does not close: {:.3e} heat in, '
+                           '{:.3e} stored'.format(heat.sum(), storage.sum()))
+    return residual / scale
+
+
+def bench_steps(path, nsteps, nr, repeat):
+    """time RprofData and TimeData on one number of steps"""
+    rng = np.random.default_rng(0)
+    rprof = os.path.join(path, 'test_rprof.dat')
+    tdat = os.path.join(path, 'test_time.dat')
+    synthetic.write_rprof(rprof, nsteps, nr, rng)
+    synthetic.write_time(tdat, nsteps, rng)
+    results = []
+    for name, cls, fname in (('RprofData', RprofData, rprof),
+                             ('TimeData', TimeData, tdat)):
+        wall, peak, _ = measure(lambda: cls(make_args(path, nsteps)), repeat)
+        results.append({'bench': name, 'steps': nsteps, 'nr': nr,
+                        'wall': wall, 'peak': peak,
+                        'bytes': os.path.getsize(fname)})
+    return results
+
+
+def print_results(results):
+    """table of results"""
+    mega = 2.**20
+    print('{:<16}{:>16}{:>10}{:>10}{:>10}'.format(
+        'bench', 'size', 'wall ms', 'MB/s', 'peak MB'))
+    for res in results:
+        if 'steps' in res:
+            size = '{} steps'.format(res['steps'])
+        else:
+            size = '{}x{}'.format(res['nph'], res['nr'])
+        rate = res['bytes'] / mega / res['wall'] if 'bytes' in res else np.nan
+        print('{:<16}{:>16}{:>10.2f}{:>10.1f}{:>10.1f}'.format(
+            res['bench'], size, res['wall'] * 1e3, rate, res['peak'] / mega))
+
+
+def main():
+    """benchmark entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nph', type=int, nargs='+',
+                        default=[512, 2048, 8192])
+    parser.add_argument('--nr', type=int, default=64)
+    parser.add_argument('--steps', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--magic', type=int, default=9)
+    parser.add_argument('--bits', type=int, default=32, choices=(32, 64))
+    parser.add_argument('--decomp', type=int, nargs=4, default=(1, 1, 1, 1),
+                        metavar=('NNTH', 'NNPH', 'NNR', 'NNB'))
+    parser.add_argument('-n', '--repeat', type=int, default=3)
+    parser.add_argument('--json', help='dump results in a json file')
+    args = parser.parse_args()
+    print('energy budget of the sample run closes within {:.1%}'.format(
+        check_energy_budget()))
+    results = []
+    with tempfile.TemporaryDirectory() as path:
+        for nph in args.nph:
+            results.extend(bench_grid(path, nph, args.nr, args.repeat,
+                                      args.magic, args.bits, args.decomp))
+        for nsteps in args.steps:
+            results.extend(bench_steps(path, nsteps, args.nr, args.repeat))
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as fid:
+            json.dump(results, fid, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Startup time of StagPy sub commands
+
+Each command is run several times in a fresh interpreter, the best and
+median wall times are reported.  Use it from the root of the repository:
+
+    python3 bench/startup.py [-n REPEAT] [cmd ...]
+
+The modules taking the longest to import are listed with --imports.
+With --complete, shell completion of the command lines is timed instead.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = ('version', 'var', '-h')
+
+
+def run(cmd, extra=(), complete=False):
+    """run stagpy with cmd, return wall time and stderr"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, (ROOT, env.get('PYTHONPATH'))))
+    if complete:
+        # argcomplete reads the line from the environment and writes
+        # completions to file descriptor 8
+        line = ' '.join(['stagpy'] + cmd)
+        env.update(_ARGCOMPLETE='1', _ARGCOMPLETE_SHELL='bash',
+                   COMP_LINE=line, COMP_POINT=str(len(line)))
+        cmd = []
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 8)
+    tic = time.perf_counter()
+    proc = subprocess.run([sys.executable, *extra, '-m', 'stagpy'] + cmd,
+                          env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True,
+                          pass_fds=(8,))
+    toc = time.perf_counter()
+    os.close(8)
+    os.close(devnull)
+    return toc - tic, proc.stderr
+
+
+def run_python():
+    """wall time of a bare interpreter"""
+    tic = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    return time.perf_counter() - tic
+
+
+def import_times(cmd, nshow, complete):
+    """slowest imports according to python -X importtime"""
+    _, err = run(cmd, ('-X', 'importtime'), complete)
+    times = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumul, name = line[len('import time:'):].split('|')
+        times.append((int(cumul), name.strip()))
+    return sorted(times, reverse=True)[:nshow]
+
+
+def main():
+    """benchmark entry point"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cmd', nargs='*', default=COMMANDS,
+                        help='sub commands to time')
+    parser.add_argument('-n', '--repeat', type=int, default=10)
+    parser.add_argument('--imports', type=int, default=0, metavar='N',
+                        help='show the N slowest imports of each command')
+    parser.add_argument('--complete', action='store_true',
+                        help='time shell completion of the command lines')
+    args = parser.parse_args()
+    baseline = min(run_python() for _ in range(args.repeat))
+    print('{:>20} {:>9} {:>9}'.format('command', 'best ms', 'median ms'))
+    print('{:>20} {:9.1f}'.format('(python startup)', baseline * 1e3))
+    for cmd in args.cmd:
+        times = [run(cmd.split(), complete=args.complete)[0]
+                 for _ in range(args.repeat)]
+        print('{:>20} {:9.1f} {:9.1f}'.format(
+            cmd, min(times) * 1e3, statistics.median(times) * 1e3))
+        for cumul, name in import_times(cmd.split(), args.imports,
+                                        args.complete):
+            print('{:>30} {:9.1f}'.format(name, cumul / 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""Synthetic StagYY output
+
+Write binary field files in the format read by stagdata.BinData, along
+with matching topography, rprof.dat, time.dat and par files, to test and
+benchmark StagPy on runs of any size.  Magic versions 4 to 9 are
+supported (BinData needs at least version 4 to get the grid geometry), in
+32 or 64 bits, with any decomposition in parallel subdomains and several
+blocks.
+
+    python3 bench/synthetic.py OUTDIR [--nph NPH] [--nr NR] [--steps N]
+
+The horizontal velocity at the surface is made of rigid plates separated
+by sharp trenches and ridges so that the plates analysis has something to
+detect.
+"""
+
+import argparse
+import os.path
+import numpy as np
+
+# number of columns of rprof.dat profiles
+RPROF_NCOLS = 70
+TIME_COLS = ('istep time F_top F_bot Tmin Tmean Tmax Vmin Vrms Vmax '
+             'eta_min eta_mean eta_max ra_eff Nu_top Nu_bot C_min C_mean '
+             'C_max F_mean F_max erupt_rate erupta erupt_heatflux '
+             'entrainment Cmass_error H_int Vr_rms Vrb_rms Pb_rms '
+             'dVrdr_rms').split()
+# field name in file names for each variable
+PAR_TYPES = {'t': 't', 'c': 'c', 'n': 'eta', 'd': 'rho', 'a': 'age',
+             'h': 'wtr', 'vp': 'vp'}
+# number of plates at the surface, even to alternate ridges and trenches
+NPLATES = 6
+
+
+class Grid:
+
+    """annulus grid shared by all the fields of a run"""
+
+    def __init__(self, nph, nr, nth=1, nblocks=1, rcmb=1.19):
+        """cell-centered coordinates of a nth x nph x nr grid"""
+        self.nth, self.nph, self.nr = nth, nph, nr
+        self.nblocks = nblocks
+        self.rcmb = rcmb
+        dph = 2 * np.pi / nph
+        self.ph_coord = (np.arange(nph) + 0.5) * dph
+        self.th_coord = (np.arange(nth) + 0.5) * np.pi / nth
+        self.r_edges = np.linspace(0, 1, nr + 1)
+        self.r_coord = (self.r_edges[1:] + self.r_edges[:-1]) / 2
+
+    def rgeom(self):
+        """edges and centers of radial cells, interleaved"""
+        rgeom = np.empty(2 * self.nr + 1)
+        rgeom[::2] = self.r_edges
+        rgeom[1::2] = self.r_coord
+        return rgeom
+
+
+def plate_velocity(grid, nplates, rng, width=2.):
+    """horizontal velocity of rigid plates at the surface
+
+    Plates move alternately towards phi > 0 and phi < 0, so that with an
+    even nplates there are nplates // 2 ridges and as many trenches.
+    Their boundaries are well apart and the velocity jumps are smoothed
+    over a few cells (gaussian of width cells), as detect_plates looks for
+    a single extremum of the velocity gradient at each boundary.  It
+    decreases linearly with depth, return an array (nr, nph)
+    """
+    spacing = grid.nph / nplates
+    jitter = rng.uniform(-spacing / 4, spacing / 4, nplates)
+    bounds = ((np.arange(nplates) + 0.5) * spacing + jitter).astype(int)
+    speeds = rng.uniform(200, 500, nplates) * (-1)**np.arange(nplates)
+    # the first and last plates are the same one across phi = 0
+    surface = speeds[np.searchsorted(bounds, np.arange(grid.nph),
+                                     side='right') % nplates]
+    # the kernel is shifted by half a cell since detect_plates first
+    # interpolates the velocity between cells, the gradient then peaks
+    # at a single point
+    half = int(4 * width)
+    kernel = np.exp(-0.5 * ((np.arange(-half, half) + 0.5) / width)**2)
+    surface = np.convolve(np.concatenate((surface[-half:], surface,
+                                          surface[:half - 1])),
+                          kernel / kernel.sum(), mode='valid')
+    return grid.r_coord[:, np.newaxis] * surface
+
+
+def fields(grid, step, rng, nplates=NPLATES):
+    """synthetic fields of a snapshot, arrays of shape (nr, nph)"""
+    rad = grid.r_coord[:, np.newaxis]
+    phi = grid.ph_coord[np.newaxis, :]
+    pert = 0.05 * np.sin(3 * phi + 0.1 * step) * np.sin(np.pi * rad)
+    temp = 1 - rad + pert + 0.01 * rng.standard_normal((grid.nr, grid.nph))
+    vphi = plate_velocity(grid, nplates, rng)
+    flds = {
+        't': temp,
+        'c': np.clip(1 + 3 * rad + pert, 0, 4),
+        'n': 10**(3 * rad - 2 * temp),
+        'd': 1 + 0.02 * (0.5 - temp),
+        'a': np.abs(phi - np.pi) * np.ones_like(rad),
+        'h': np.zeros_like(temp),
+        'u': np.zeros_like(temp),
+        'v': vphi,
+        'w': 50 * np.cos(3 * phi) * np.sin(np.pi * rad),
+        'p': -rad * np.ones_like(phi),
+    }
+    return flds
+
+
+class BinWriter:
+
+    """write a binary file in the StagYY format"""
+
+    def __init__(self, fname, magic=9, bits=32):
+        """file name, magic version and number of bits of words"""
+        if not 4 <= magic <= 9:
+            raise ValueError('magic version should be between 4 and 9')
+        self.fname = fname
+        self.magic = magic
+        self.itype = np.dtype('i4' if bits == 32 else 'i8')
+        self.ftype = np.dtype('f4' if bits == 32 else 'f8')
+        self._fid = None
+
+    def _int(self, *vals):
+        """write integer words"""
+        self._fid.write(np.array(vals, self.itype).tobytes())
+
+    def _flt(self, *vals):
+        """write float words"""
+        self._fid.write(np.array(vals, self.ftype).ravel().tobytes())
+
+    def write(self, grid, comps, decomp=(1, 1, 1, 1), step=0, time=0.):
+        """write the components of a field
+
+        comps is a list of arrays (nblocks, nr, nph, nth), four of them
+        for a velocity-pressure field.  decomp is the number of parallel
+        subdomains in the th, ph, r and block directions.
+        """
+        nval = len(comps)
+        nnth, nnph, nnr, nnb = decomp
+        magic = self.magic
+        nblocks = grid.nblocks
+        if magic < 7:
+            # a single block is implied
+            nblocks = 1
+            comps = [comp[:1] for comp in comps]
+        if magic < 8:
+            nnb = 1
+        # extra ghost point in horizontal direction
+        xyp = int(magic >= 9 and nval == 4)
+        head = magic + 100 * nval if nval > 1 else magic
+        with open(self.fname, 'wb') as self._fid:
+            if self.itype.itemsize == 8:
+                self._int(head + 8000)
+            else:
+                self._int(head)
+            self._int(grid.nth, grid.nph, grid.nr)
+            if magic >= 7:
+                self._int(nblocks)
+            self._flt(1., 1.)
+            self._int(nnth, nnph, nnr)
+            if magic >= 8:
+                self._int(nnb)
+            self._flt(grid.rgeom())
+            if magic >= 7:
+                self._flt(grid.rcmb)
+            self._int(step)
+            self._flt(time)
+            if magic >= 5:
+                self._flt(0.)  # erupta_total
+            if magic >= 6:
+                self._flt(1.)  # bot_temp
+            self._flt(grid.th_coord)
+            self._flt(grid.ph_coord)
+            self._flt(grid.r_coord)
+            scalefac = 1.
+            if nval > 1:
+                scalefac = max(float(np.amax(np.abs(comps))), 1.)
+                self._flt(scalefac)
+            # ghost points are the first ones of the next subdomain
+            allc = np.stack(comps, axis=-1) / scalefac
+            if xyp:
+                allc = np.concatenate([allc, allc[:, :, :1]], axis=2)
+                allc = np.concatenate([allc, allc[:, :, :, :1]], axis=3)
+            nth, nph = grid.nth // nnth, grid.nph // nnph
+            nrd, nbk = grid.nr // nnr, nblocks // nnb
+            for ibc in range(nnb):
+                for irc in range(nnr):
+                    for iphc in range(nnph):
+                        for ithc in range(nnth):
+                            self._flt(allc[
+                                ibc * nbk:(ibc + 1) * nbk,
+                                irc * nrd:(irc + 1) * nrd,
+                                iphc * nph:(iphc + 1) * nph + xyp,
+                                ithc * nth:(ithc + 1) * nth + xyp])
+
+
+def _as_comp(grid, fld):
+    """(nr, nph) field to a (nblocks, nr, nph, nth) component"""
+    comp = np.broadcast_to(fld[np.newaxis, :, :, np.newaxis],
+                           (grid.nblocks, grid.nr, grid.nph, grid.nth))
+    return np.array(comp)
+
+
+def write_snapshot(path, name, grid, step, time, rng, magic=9, bits=32,
+                   decomp=(1, 1, 1, 1), variables=('t', 'c', 'n', 'a', 'vp')):
+    """write binary files of all variables at a given step"""
+    flds = fields(grid, step, rng)
+    for var in variables:
+        fname = os.path.join(path, '{}_{}{:05d}'.format(
+            name, PAR_TYPES[var], step))
+        if var == 'vp':
+            comps = [_as_comp(grid, flds[cmp]) for cmp in 'uvwp']
+        else:
+            comps = [_as_comp(grid, flds[var])]
+        BinWriter(fname, magic, bits).write(grid, comps, decomp, step, time)
+    return flds
+
+
+def write_topo(fname, grid, step):
+    """write the surface topography file of a snapshot"""
+    topo = 1e-4 * np.sin(3 * grid.ph_coord + 0.1 * step)
+    np.savetxt(fname, np.column_stack((grid.ph_coord, topo)), fmt='%15.8E')
+
+
+def write_par(fname, name):
+    """write a minimal par file, other parameters take default values"""
+    with open(fname, 'w') as fid:
+        fid.write("&geometry\n shape = 'annulus'\n/\n"
+                  "&ioin\n output_file_stem = '{}'\n/\n".format(name))
+
+
+def write_rprof(fname, nsteps, nz, rng, dtime=1e-5, regrid=None):
+    """write rprof.dat with nsteps profiles of nz points
+
+    the number of points becomes regrid[1] from step regrid[0] on
+    """
+    with open(fname, 'w') as fid:
+        for istep in range(nsteps):
+            npts = nz
+            if regrid is not None and istep >= regrid[0]:
+                npts = regrid[1]
+            fid.write('*******************step: {:6d} ; time = {:12.4E}\n'
+                      .format(istep, istep * dtime))
+            rad = (np.arange(npts) + 0.5) / npts
+            prof = rng.uniform(0, 1, (npts, RPROF_NCOLS))
+            prof[:, 0] = rad
+            prof[:, 1] = 1 - rad + 0.01 * rng.standard_normal(npts)
+            prof[:, 63] = np.arange(npts) / npts
+            np.savetxt(fid, prof, fmt='%15.8E')
+
+
+def write_time(fname, nsteps, rng, dtime=1e-5):
+    """write time.dat with nsteps lines"""
+    data = rng.uniform(0, 1, (nsteps, len(TIME_COLS)))
+    data[:, 1] = np.arange(nsteps) * dtime
+    with open(fname, 'w') as fid:
+        fid.write('  '.join(TIME_COLS) + '\n')
+        for istep, row in enumerate(data):
+            fid.write('{:8d} '.format(istep) +
+                      ' '.join('{:.20E}'.format(val) for val in row[1:]) +
+                      '\n')
+
+
+def write_run(path, name='test', nph=512, nr=64, nsnaps=2, nsteps=100,
+              magic=9, bits=32, decomp=(1, 1, 1, 1), nblocks=1, seed=0):
+    """write a full synthetic run
+
+    par file, nsnaps binary snapshots with their topography, rprof.dat
+    and time.dat of nsteps steps.  Return the grid.
+    """
+    rng = np.random.default_rng(seed)
+    grid = Grid(nph, nr, nblocks=nblocks)
+    write_par(os.path.join(path, 'par'), name)
+    for step in range(nsnaps):
+        write_snapshot(path, name, grid, step, step * 1e-5, rng,
+                       magic, bits, decomp)
+        write_topo(os.path.join(path, '{}_sc{:05d}.dat'.format(name, step)),
+                   grid, step)
+    write_rprof(os.path.join(path, name + '_rprof.dat'), nsteps, nr, rng)
+    write_time(os.path.join(path, name + '_time.dat'), nsteps, rng)
+    return grid
+
+
+def main():
+    """generate a synthetic run from the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('outdir')
+    parser.add_argument('--name', default='test')
+    parser.add_argument('--nph', type=int, default=512)
+    parser.add_argument('--nr', type=int, default=64)
+    parser.add_argument('--snaps', type=int, default=2,
+                        help='number of binary snapshots')
+    parser.add_argument('--steps', type=int, default=100,
+                        help='number of steps in rprof.dat and time.dat')
+    parser.add_argument('--magic', type=int, default=9)
+    parser.add_argument('--bits', type=int, default=32, choices=(32, 64))
+    parser.add_argument('--decomp', type=int, nargs=4, default=(1, 1, 1, 1),
+                        metavar=('NNTH', 'NNPH', 'NNR', 'NNB'))
+    parser.add_argument('--blocks', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+    write_run(args.outdir, args.name, args.nph, args.nr, args.snaps,
+              args.steps, args.magic, args.bits, args.decomp, args.blocks,
+              args.seed)
+
+
+if __name__ == '__main__':
+    main()
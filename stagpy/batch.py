@@ -0,0 +1,95 @@
+"""several analyses in a single pass over the data
+
+Each analysis (time, rprof, field or plates) runs with the options of the
+corresponding sub command read in the config file, and the core options
+given to batch.  Inputs are read once and shared between analyses with a
+stagdata.DataCache:
+
+- time.dat and rprof.dat are read in background threads as soon as batch
+  starts;
+- the analyses of snapshots advance together one timestep at a time, so
+  that each snapshot is read once, and the snapshots of the next timestep
+  are read while the current one is processed.
+
+Only reading is overlapped with processing: the analyses themselves run
+one after the other in the main thread, since pyplot is not thread safe.
+"""
+
+import argparse
+from collections import OrderedDict
+from . import commands, config, misc
+from .stagdata import DataCache, RprofData, TimeData
+
+# inputs read ahead for each analysis
+INPUTS = OrderedDict((
+    ('time', (TimeData,)),
+    ('rprof', (RprofData,)),
+    ('field', ()),
+    ('plates', (RprofData,)),
+))
+
+
+def _field_steps(args):
+    """timesteps of field"""
+    from . import field
+    commands.prepare_field(args)
+    return field.field_steps(args)
+
+
+def _plates_steps(args):
+    """timesteps of plates"""
+    from . import plates
+    commands.prepare_plates(args)
+    return plates.plates_steps(args)
+
+
+# analyses of snapshots, generators yielding each processed timestep
+STEPS = {'field': _field_steps, 'plates': _plates_steps}
+
+
+def analysis_args(args, name):
+    """core options of args and options of the name sub command"""
+    sub_args = argparse.Namespace(**vars(args))
+    for opt, conf in config.SUB_CMDS[name].conf_dict.items():
+        setattr(sub_args, opt, conf.default)
+    return sub_args
+
+
+def batch_cmd(args):
+    """run the analyses listed in args.analyses"""
+    names = [name.strip() for name in args.analyses.split(',')
+             if name.strip()]
+    unknown = [name for name in names if name not in INPUTS]
+    if unknown:
+        misc.stop('unknown analyses', *unknown,
+                  '(choose among {})'.format(', '.join(INPUTS)))
+    all_args = OrderedDict((name, analysis_args(args, name))
+                           for name in names)
+    misc.parse_timesteps(args)
+    cache = DataCache(args, args.readers)
+    for name, sub_args in all_args.items():
+        sub_args.cache = cache
+        for cls in INPUTS[name]:
+            cache.prefetch(cls)
+
+    # time series and profiles
+    for name, sub_args in all_args.items():
+        if name not in STEPS:
+            config.SUB_CMDS[name].func(sub_args)
+
+    # snapshots
+    steppers = [STEPS[name](sub_args) for name, sub_args in all_args.items()
+                if name in STEPS]
+    done = object()
+    istart, ilast, istep = args.timestep
+    for timestep in range(istart, ilast, istep):
+        cache.prefetch_snapshots(timestep)
+        if timestep + istep < ilast:
+            cache.prefetch_snapshots(timestep + istep)
+        steppers = [stepper for stepper in steppers
+                    if next(stepper, done) is not done]
+    # e.g. when plates skips timesteps already processed
+    for stepper in steppers:
+        for _ in stepper:
+            pass
+    cache.close()
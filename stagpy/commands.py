@@ -1,21 +1,35 @@
-"""definition of each subcommands"""
+"""definition of each subcommands
 
-from . import constants, misc, field, rprof, time_series, plates
+modules doing the actual work are imported by the sub command using
+them, this keeps the startup of the other ones fast
+"""
+
+from . import constants, misc
 from . import __version__
 
 
-def field_cmd(args):
-    """plot snapshots of fields"""
+def prepare_field(args):
+    """process options of field"""
+    if args.globalscale and args.watch:
+        misc.stop('+globalscale cannot be used with +watch, limits are only',
+                  'computed over the timesteps of the -s range')
     misc.parse_timesteps(args)
     misc.plot_backend(args)
     if args.plot is not None:
         for var, meta in constants.FIELD_VAR_LIST.items():
             misc.set_arg(args, meta.arg, var in args.plot)
+
+
+def field_cmd(args):
+    """plot snapshots of fields"""
+    from . import field
+    prepare_field(args)
     field.field_cmd(args)
 
 
 def rprof_cmd(args):
     """plot radial profiles"""
+    from . import rprof
     misc.parse_timesteps(args)
     misc.plot_backend(args)
     if args.plot is not None:
@@ -33,20 +47,40 @@ def rprof_cmd(args):
 
 def time_cmd(args):
     """plot time series"""
+    from . import time_series
     misc.parse_timesteps(args)
-    if args.compstat:
+    if args.compstat and args.clickstat and args.tstart < 0:
         args.matplotback = None
     misc.plot_backend(args)
     time_series.time_cmd(args)
 
 
-def plates_cmd(args):
-    """plate analysis"""
+def prepare_plates(args):
+    """process options of plates"""
     misc.parse_timesteps(args)
     misc.plot_backend(args)
+
+
+def plates_cmd(args):
+    """plate analysis"""
+    from . import plates
+    prepare_plates(args)
     plates.plates_cmd(args)
 
 
+def batch_cmd(args):
+    """several analyses in one pass"""
+    from . import batch
+    batch.batch_cmd(args)
+
+
+def serve_cmd(args):
+    """keep runs in memory for local clients"""
+    from . import serve
+    misc.plot_backend(args)
+    serve.serve_cmd(args)
+
+
 def var_cmd(_):
     """display a list of available variables"""
     print('field:')
@@ -6,13 +6,10 @@ and deal with the config file
 
 from collections import OrderedDict, namedtuple
 from os import mkdir
-from subprocess import call
-import argcomplete
 import argparse
 import configparser
 import os.path
-import shlex
-from . import commands, parfile
+from . import commands
 from .constants import CONFIG_DIR
 
 CONFIG_FILE = os.path.join(CONFIG_DIR, 'config')
@@ -43,6 +40,13 @@ CORE = OrderedDict((
                          True, 'graphical backend')),
     ('useseaborn', Conf(True, False, None, {},
                         True, 'use or not seaborn')),
+    ('incremental', Conf(False, True, None, {},
+                         True, ('skip outputs written after the last change '
+                                'of their inputs and options'))),
+    ('profile', Conf(None, True, None,
+                     {'nargs': '?', 'const': '', 'type': str},
+                     False, ('time processing stages, optionally dump them '
+                             'to a .json file or a cProfile .prof file'))),
 ))
 FIELD = OrderedDict((
     ('plot',
@@ -89,6 +93,33 @@ FIELD = OrderedDict((
     ('shrinkcb',
         Conf(0.5, False, None, {},
              True, 'color bar shrink factor')),
+    ('reusefig',
+        Conf(False, True, None, {},
+             True, 'reuse figures between timesteps (faster)')),
+    ('movie',
+        Conf(False, True, None, {},
+             False, 'produce one animation per field instead of pdf files')),
+    ('fps',
+        Conf(10, True, None, {},
+             True, 'frames per second of animations')),
+    ('globalscale',
+        Conf(False, True, None, {},
+             True, 'same color scale for all timesteps')),
+    ('perc_min',
+        Conf(0., True, None, {},
+             True, 'percentile used as lower bound of global color scale')),
+    ('perc_max',
+        Conf(100., True, None, {},
+             True, 'percentile used as upper bound of global color scale')),
+    ('fullres',
+        Conf(False, True, None, {},
+             True, 'plot fields at full resolution (no decimation)')),
+    ('watch',
+        Conf(False, True, None, {},
+             False, 'process new snapshots as they are written')),
+    ('poll',
+        Conf(10., True, None, {},
+             True, 'seconds between two polls of the run with +watch')),
 ))
 
 RPROF = OrderedDict((
@@ -142,12 +173,22 @@ RPROF = OrderedDict((
         Conf(False, False, None, {},
              True, 'plot difference between T and C profs and overturned \
                 version of their initial values')),
+    ('batchplot',
+        Conf(False, True, None, {},
+             True, 'draw all profiles at once, faster for many profiles')),
+    ('overturn',
+        Conf(False, True, None, {},
+             False, 'only write overturn diagnostic to a text file')),
 ))
 
 TIME = OrderedDict((
     ('compstat',
         Conf(False, True, None, {},
              True, 'compute steady state statistics')),
+    ('clickstat',
+        Conf(True, True, None, {},
+             True, 'select start of statistics with a mouse click, '
+                   'steady state is detected if false and tstart unset')),
     ('energy',
         Conf(False, True, None, {},
              True, 'display energy balance in the heat flow plot')),
@@ -166,6 +207,12 @@ TIME = OrderedDict((
     ('tminc',
         Conf(0., True, None, {},
              False, 'specify tminc')),
+    ('decimate',
+        Conf(True, True, None, {},
+             True, 'decimate long time series before plotting')),
+    ('npoints',
+        Conf(4000, True, None, {},
+             True, 'max number of points of decimated time series')),
 ))
 
 PLATES = OrderedDict((
@@ -175,9 +222,51 @@ PLATES = OrderedDict((
     ('timeprofile',
         Conf(False, True, None, {},
              True, 'plots nb of plates in function of time')),
+    ('resume',
+        Conf(False, True, None, {},
+             False, 'resume an interrupted analysis from its checkpoint')),
+    ('jobs',
+        Conf(1, True, 'j', {},
+             True, 'number of timesteps treated in parallel')),
+    ('binary',
+        Conf(False, True, None, {},
+             True, 'also write results as numpy binary files')),
     ('shrinkcb',
         Conf(0.5, False, None, {},
              True, 'color bar shrink factor')),
+    ('fullres',
+        Conf(False, True, None, {},
+             True, 'plot fields at full resolution (no decimation)')),
+    ('watch',
+        Conf(False, True, None, {},
+             False, 'process new snapshots as they are written')),
+    ('poll',
+        Conf(10., True, None, {},
+             True, 'seconds between two polls of the run with +watch')),
+))
+
+BATCH = OrderedDict((
+    ('analyses',
+        Conf('time,rprof,field,plates', True, 'a', {},
+             True, 'comma separated list of analyses run on the data')),
+    ('readers',
+        Conf(2, True, None, {},
+             True, 'number of threads reading data ahead')),
+))
+
+SERVE = OrderedDict((
+    ('port',
+        Conf(8700, True, None, {},
+             True, 'port of the server on localhost')),
+    ('socket',
+        Conf('', True, None, {},
+             True, 'path of a Unix socket to listen on instead of a port')),
+    ('snapshots',
+        Conf(8, True, None, {},
+             True, 'number of timesteps of snapshots kept per run')),
+    ('readers',
+        Conf(2, True, None, {},
+             True, 'number of threads reading files')),
 ))
 
 VAR = OrderedDict((
@@ -205,6 +294,8 @@ def config_cmd(args):
     if args.create or args.update:
         create_config()
     if args.edit:
+        import shlex
+        from subprocess import call
         call(shlex.split(args.editor + ' ' + CONFIG_FILE))
 
 Sub = namedtuple('Sub', ['conf_dict', 'use_core', 'func', 'help_string'])
@@ -217,6 +308,11 @@ SUB_CMDS = OrderedDict((
                  'plot temporal series')),
     ('plates', Sub(PLATES, True, commands.plates_cmd,
                    'plate analysis')),
+    ('batch', Sub(BATCH, True, commands.batch_cmd,
+                  'run several analyses reading the data once '
+                  '(reading overlaps processing, analyses run in turn)')),
+    ('serve', Sub(SERVE, True, commands.serve_cmd,
+                  'serve decoded runs to local clients')),
     ('var', Sub(VAR, False, commands.var_cmd,
                 'print the list of variables')),
     ('version', Sub(VERSION, False, commands.version_cmd,
@@ -333,8 +429,39 @@ def add_args(parser, conf_dict):
     return parser
 
 
+def build_parser():
+    """create the full cmd line parser
+
+    it relies only on the current defaults of conf_dicts
+    """
+    main_parser = argparse.ArgumentParser(
+        description='read and process StagYY binary data')
+    main_parser = add_args(main_parser, {'path': CORE['path']})
+    main_parser.set_defaults(func=lambda _: print('stagpy -h for usage'))
+    subparsers = main_parser.add_subparsers()
+
+    core_parser = argparse.ArgumentParser(add_help=False, prefix_chars='-+')
+    core_parser = add_args(core_parser, CORE)
+    # default name is read from the par file once the sub command is known
+    core_parser.set_defaults(name=None)
+
+    for sub_cmd, meta in SUB_CMDS.items():
+        kwargs = {'prefix_chars': '+-', 'help': meta.help_string}
+        if meta.use_core:
+            kwargs.update(parents=[core_parser])
+        dummy_parser = subparsers.add_parser(sub_cmd, **kwargs)
+        dummy_parser = add_args(dummy_parser, meta.conf_dict)
+        dummy_parser.set_defaults(func=meta.func)
+    return main_parser
+
+
 def parse_args():
     """Parse cmd line arguments"""
+    if '_ARGCOMPLETE' in os.environ:
+        # shell completion, only static metadata is needed.
+        # autocomplete exits once completions are output
+        import argcomplete
+        argcomplete.autocomplete(build_parser())
     # get path from config file before
     if not os.path.isdir(CONFIG_DIR):
         mkdir(CONFIG_DIR)
@@ -365,27 +492,14 @@ def parse_args():
     if keep_cmd_path:
         args.path = cmd_path
         _set_conf_default(CORE, 'path', args.path)
-    par_nml = parfile.readpar(args)
-
-    main_parser = argparse.ArgumentParser(
-        description='read and process StagYY binary data')
-    main_parser = add_args(main_parser, {'path': CORE['path']})
-    main_parser.set_defaults(func=lambda _: print('stagpy -h for usage'))
-    subparsers = main_parser.add_subparsers()
-
-    core_parser = argparse.ArgumentParser(add_help=False, prefix_chars='-+')
-    core_parser = add_args(core_parser, CORE)
-    core_parser.set_defaults(name=par_nml['ioin']['output_file_stem'])
-
-    for sub_cmd, meta in SUB_CMDS.items():
-        kwargs = {'prefix_chars': '+-', 'help': meta.help_string}
-        if meta.use_core:
-            kwargs.update(parents=[core_parser])
-        dummy_parser = subparsers.add_parser(sub_cmd, **kwargs)
-        dummy_parser = add_args(dummy_parser, meta.conf_dict)
-        dummy_parser.set_defaults(func=meta.func)
 
-    argcomplete.autocomplete(main_parser)
-    args = main_parser.parse_args()
-    args.par_nml = par_nml
-    return args
+    cmd_args = build_parser().parse_args()
+    # the par file is only needed by sub commands processing StagYY data
+    sub_cmd = next((sub for sub, meta in SUB_CMDS.items()
+                    if meta.func is cmd_args.func), None)
+    if sub_cmd is not None and SUB_CMDS[sub_cmd].use_core:
+        from . import parfile
+        cmd_args.par_nml = parfile.readpar(args)
+        if cmd_args.name is None:
+            cmd_args.name = cmd_args.par_nml['ioin']['output_file_stem']
+    return cmd_args
@@ -1,13 +1,18 @@
 """plot fields"""
 
+import hashlib
+import importlib
+import itertools
+import json
+import os.path
 import numpy as np
-from . import constants, misc
-from .stagdata import BinData
+from . import constants, misc, timing, watch
+from .manifest import Manifest
+from .stagdata import BinData, load
 
 
-def plot_scalar(args, stgdat, var):
-    """var: one of the key of constants.FIELD_VAR_LIST"""
-    plt = args.plt
+def _scalar_field(stgdat, var):
+    """field to plot, var: one of the key of constants.FIELD_VAR_LIST"""
     if var == 's':
         fld = stgdat.calc_stream()
     else:
@@ -21,10 +26,69 @@ def plot_scalar(args, stgdat, var):
         else:
             newline = fld[:, 0, 0]
             fld = np.vstack([fld[:, :, 0].T, newline])
+    return fld
+
+
+def _block_reduce(arr, blk_ph, blk_r, ufunc):
+    """reduce arr by blocks of blk_ph x blk_r points with ufunc"""
+    arr = ufunc.reduceat(arr, np.arange(0, arr.shape[0], blk_ph), axis=0)
+    return ufunc.reduceat(arr, np.arange(0, arr.shape[1], blk_r), axis=1)
+
+
+def decimate(args, fig, xmesh, ymesh, fld, var):
+    """decrease resolution of a field to the one of the figure
+
+    The number of points kept in each direction is twice the number of
+    pixels spanned by the annulus in the saved figure.  Blocks of points
+    are averaged, except for the viscosity where the value furthest from
+    the mean of the block in log scale is kept, to preserve both weak
+    zones and stiff slabs.  The last row in phi, that closes the annulus,
+    is recomputed from the first one.
+    """
+    if args.fullres or fld.shape != xmesh.shape:
+        return xmesh, ymesh, fld
+    dpi = args.mpl.rcParams['savefig.dpi']
+    if dpi == 'figure':
+        dpi = fig.dpi
+    diam = min(fig.get_size_inches()) * dpi
+    radius = np.sqrt(xmesh**2 + ymesh**2)
+    rmin, rmax = np.amin(radius), np.amax(radius)
+    blk_ph = int(xmesh.shape[0] / (2 * np.pi * diam)) or 1
+    blk_r = int(xmesh.shape[1] / (diam * (rmax - rmin) / rmax)) or 1
+    if blk_ph == 1 and blk_r == 1:
+        return xmesh, ymesh, fld
+    ones = np.ones(fld[:-1].shape)
+    count = _block_reduce(ones, blk_ph, blk_r, np.add)
+    xmesh = _block_reduce(xmesh[:-1], blk_ph, blk_r, np.add) / count
+    ymesh = _block_reduce(ymesh[:-1], blk_ph, blk_r, np.add) / count
+    if var == 'n':
+        logfld = np.log(np.maximum(fld[:-1], np.finfo(float).tiny))
+        lmean = _block_reduce(logfld, blk_ph, blk_r, np.add) / count
+        lmin = _block_reduce(logfld, blk_ph, blk_r, np.minimum)
+        lmax = _block_reduce(logfld, blk_ph, blk_r, np.maximum)
+        fld = np.exp(np.where(lmax - lmean > lmean - lmin, lmax, lmin))
+    else:
+        fld = _block_reduce(fld[:-1], blk_ph, blk_r, np.add) / count
+    return (np.vstack([xmesh, xmesh[0]]), np.vstack([ymesh, ymesh[0]]),
+            np.vstack([fld, fld[0]]))
+
+
+def plot_scalar(args, stgdat, var):
+    """var: one of the key of constants.FIELD_VAR_LIST
+
+    fields are decimated to the resolution of the figure
+    unless args.fullres is set
+    """
+    plt = args.plt
+    with timing.stage('derived'):
+        fld = _scalar_field(stgdat, var)
 
     xmesh, ymesh = stgdat.x_mesh[0, :, :], stgdat.y_mesh[0, :, :]
 
     fig, axis = plt.subplots(ncols=1)
+    if var != 'r':
+        with timing.stage('derived'):
+            xmesh, ymesh, fld = decimate(args, fig, xmesh, ymesh, fld, var)
     if stgdat.geom == 'annulus':
         if var == 'n':  # viscosity
             surf = axis.pcolormesh(xmesh, ymesh, fld,
@@ -61,6 +125,28 @@ def plot_scalar(args, stgdat, var):
     return fig, axis, surf
 
 
+def update_scalar(args, stgdat, var, fig, surf):
+    """update mesh created by plot_scalar with data of another snapshot
+
+    This is much faster than creating a new figure with plot_scalar.
+    Return False if the mesh cannot be reused (e.g. different grid).
+    """
+    if var == 'r':
+        return False
+    with timing.stage('derived'):
+        fld = _scalar_field(stgdat, var)
+        xmesh, ymesh = stgdat.x_mesh[0, :, :], stgdat.y_mesh[0, :, :]
+        _, _, fld = decimate(args, fig, xmesh, ymesh, fld, var)
+    if surf.get_array().size != fld.size:
+        return False
+    surf.set_array(fld.ravel())
+    if var == 'd':  # density has fixed limits
+        return True
+    vmin = 0. if var == 'a' else np.amin(fld)
+    surf.set_clim(vmin=vmin, vmax=np.amax(fld))
+    return True
+
+
 def plot_stream(args, fig, axis, component1, component2):
     """use of streamplot to plot stream lines
 
@@ -74,17 +160,184 @@ def plot_stream(args, fig, axis, component1, component2):
     axis.streamplot(x_1, x_2, v_1, v_2, density=0.8, color='k', linewidth=lwd)
 
 
+def global_limits(args, variables):
+    """color limits common to all the selected timesteps
+
+    The limits of a variable are the extrema over timesteps of the
+    args.perc_min and args.perc_max percentiles of each snapshot.  They
+    are computed from the decoded fields without any plotting, and cached
+    in a json file to be reused by subsequent calls.  Cached limits are
+    specific to the run (directory and name) and to the modification
+    times of its snapshots, they are computed again if any changes.
+    """
+    cache_file = args.outname + '_clim.json'
+    cache = {}
+    if os.path.isfile(cache_file):
+        with open(cache_file) as fid:
+            cache = json.load(fid)
+    keys = {}
+    for var in variables:
+        par_type = constants.FIELD_VAR_LIST[var].par
+        mtimes = []
+        for timestep in range(*args.timestep):
+            fname = os.path.join(args.path, '{}_{}{}'.format(
+                args.name, par_type, misc.INT_FMT.format(timestep)))
+            try:
+                mtimes.append(os.stat(fname).st_mtime_ns)
+            except OSError:  # missing snapshot, reported when read
+                mtimes.append(None)
+        run = [os.path.abspath(args.path), args.name, mtimes]
+        keys[var] = '_'.join(map(str, (var,) + tuple(args.timestep) +
+                                 (args.perc_min, args.perc_max))) + '_' + \
+            hashlib.sha1(json.dumps(run).encode()).hexdigest()
+    todo = [var for var in variables if keys[var] not in cache]
+    if todo:
+        lims = {var: [np.inf, -np.inf] for var in todo}
+        for timestep in range(*args.timestep):
+            # vp fields are read only once
+            stgdats = {}
+            for var in todo:
+                par_type = constants.FIELD_VAR_LIST[var].par
+                if par_type not in stgdats:
+                    stgdats[par_type] = load(args, BinData, var, timestep)
+                fld = _scalar_field(stgdats[par_type], var)
+                if var == 'n':  # log scale
+                    fld = fld[fld > 0]
+                low, high = np.percentile(fld,
+                                          [args.perc_min, args.perc_max])
+                lims[var] = [min(lims[var][0], low), max(lims[var][1], high)]
+        for var in todo:
+            cache[keys[var]] = list(map(float, lims[var]))
+        with open(cache_file, 'w') as fid:
+            json.dump(cache, fid, indent=1)
+    return {var: cache[keys[var]] for var in variables}
+
+
+class PngSequenceWriter:
+
+    """write frames as a sequence of png files
+
+    fallback of movie_writer when no external encoder is available,
+    mimics the interface of matplotlib.animation.MovieWriter
+    """
+
+    def __init__(self):
+        """create PngSequenceWriter object"""
+        self.fig = None
+        self.fmt = None
+        self.dpi = None
+        self.frame = 0
+
+    def setup(self, fig, outfile, dpi=None):
+        """prepare writing frames of fig"""
+        self.fig = fig
+        self.dpi = dpi
+        self.fmt = os.path.splitext(outfile)[0] + '_' + misc.INT_FMT + '.png'
+        self.frame = 0
+
+    def grab_frame(self, **savefig_kwargs):
+        """save current state of the figure"""
+        self.fig.savefig(self.fmt.format(self.frame), dpi=self.dpi,
+                         **savefig_kwargs)
+        self.frame += 1
+
+    def finish(self):
+        """nothing to finalize"""
+        pass
+
+
+def movie_writer(args):
+    """return a movie writer and the extension of the output file
+
+    frames are piped to ffmpeg (mp4) or imagemagick (gif) if available,
+    they are written as a sequence of png files otherwise
+    """
+    animation = importlib.import_module('matplotlib.animation')
+    if animation.writers.is_available('ffmpeg'):
+        return animation.FFMpegWriter(fps=args.fps), '.mp4'
+    if animation.writers.is_available('imagemagick'):
+        return animation.ImageMagickWriter(fps=args.fps), '.gif'
+    return PngSequenceWriter(), '.png'
+
+
 def field_cmd(args):
-    """extract and plot field data"""
-    for timestep in range(*args.timestep):
+    """extract and plot field data
+
+    with args.reusefig, a figure is created only once per variable and
+    its mesh is updated at each timestep.  With args.movie, these figures
+    are streamed to one animation per variable.  With args.globalscale,
+    the color scale of each variable is the same for all timesteps.
+    With args.incremental, plots that are up to date are skipped (see
+    manifest).  With args.watch, new snapshots are plotted as StagYY writes
+    them, figures are kept between polls (see watch).
+    """
+    for _ in field_steps(args):
+        pass
+
+
+def field_steps(args):
+    """plot field data, yield each timestep once it is processed
+
+    see field_cmd
+    """
+    reuse = args.reusefig or args.movie or args.watch
+    figs = {}
+    writers = {}
+    clims = {}
+    if args.globalscale:
+        clims = global_limits(args, [
+            var for var, meta in constants.FIELD_VAR_LIST.items()
+            if misc.get_arg(args, meta.arg) and var != 'r'])
+    # the selection of variables doesn't change the plots
+    manifest = Manifest(args, 'field', ignore=['plot'] + [
+        meta.arg for meta in constants.FIELD_VAR_LIST.values()])
+    variables = [var for var, meta in constants.FIELD_VAR_LIST.items()
+                 if misc.get_arg(args, meta.arg)]
+    for timestep in itertools.chain.from_iterable(
+            watch.timesteps(args, variables)):
         for var, meta in constants.FIELD_VAR_LIST.items():
             if misc.get_arg(args, meta.arg):
+                output = misc.out_name(args, var).format(timestep) + '.pdf'
+                inputs = [misc.stag_file(args, meta.par, timestep)]
+                if not args.movie and manifest.up_to_date(output, inputs,
+                                                          clims.get(var)):
+                    continue
                 # will read vp many times!
-                stgdat = BinData(args, var, timestep)
-                fig, _, _ = plot_scalar(args, stgdat, var)
-                args.plt.figure(fig.number)
-                args.plt.tight_layout()
-                args.plt.savefig(
-                    misc.out_name(args, var).format(stgdat.step) + '.pdf',
-                    format='PDF')
-                args.plt.close(fig)
+                stgdat = load(args, BinData, var, timestep)
+                with timing.stage('render', timestep):
+                    if var in figs and update_scalar(
+                            args, stgdat, var, figs[var][0], figs[var][2]):
+                        fig, axis, surf = figs[var]
+                    else:
+                        if var in figs:
+                            args.plt.close(figs.pop(var)[0])
+                        if var in writers:
+                            writers.pop(var).finish()
+                        fig, axis, surf = plot_scalar(args, stgdat, var)
+                        args.plt.figure(fig.number)
+                        args.plt.tight_layout()
+                        if reuse and var != 'r':
+                            figs[var] = fig, axis, surf
+                    if var in clims:
+                        surf.set_clim(*clims[var])
+                with timing.stage('savefig', timestep):
+                    if args.movie and var in figs:
+                        axis.set_title('t = {:.4e}'.format(stgdat.ti_ad))
+                        if var not in writers:
+                            # a new animation is started if the grid changes
+                            writer, ext = movie_writer(args)
+                            writer.setup(fig, misc.out_name(args, var).format(
+                                stgdat.step) + ext)
+                            writers[var] = writer
+                        writers[var].grab_frame()
+                    else:
+                        fig.savefig(output, format='PDF')
+                        manifest.record(output, clims.get(var))
+                if var not in figs:
+                    args.plt.close(fig)
+        manifest.save()
+        yield timestep
+    for writer in writers.values():
+        writer.finish()
+    for fig, _, _ in figs.values():
+        args.plt.close(fig)
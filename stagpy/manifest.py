@@ -0,0 +1,153 @@
+"""record of produced outputs, for incremental regeneration
+
+With args.incremental, an output is not produced again if it exists, has
+been written after the last modification of all its inputs (StagYY files
+and par file), and with the same options.  The date at which outputs were
+written and a hash of the options used are recorded in a manifest file.
+Checking an output then takes one read of the manifest and one listing
+of the output directory instead of a stat of each output.  Dates of
+inputs are only read once.
+"""
+
+import base64
+import hashlib
+import json
+import os
+from . import config, __version__
+
+# options not affecting the content of outputs, the run directory is
+# hashed separately as an absolute path
+IGNORED_OPTS = ('path', 'timestep', 'incremental', 'profile', 'jobs',
+                'resume', 'watch', 'poll')
+
+
+def options_hash(args, sub_cmd, ignore=(), extra=None):
+    """hash of the options of sub_cmd that can change its outputs
+
+    extra is any json serializable value outputs depend on.  The run
+    directory is part of the hash, outputs of runs with the same name in
+    different directories are not mistaken for each other.
+    """
+    opts = {'version': __version__, 'extra': extra,
+            'run': os.path.abspath(args.path)}
+    for conf_dict in (config.CORE, config.SUB_CMDS[sub_cmd].conf_dict):
+        for opt in conf_dict:
+            if opt not in IGNORED_OPTS and opt not in ignore:
+                opts[opt] = getattr(args, opt, None)
+    dump = json.dumps(opts, sort_keys=True, default=str)
+    return hashlib.sha1(dump.encode()).hexdigest()
+
+
+def encode_rows(rows):
+    """results rows (str, bytes or None) to json serializable values"""
+    encoded = {}
+    for key, val in rows.items():
+        if isinstance(val, bytes):
+            val = {'base64': base64.b64encode(val).decode('ascii')}
+        encoded[key] = val
+    return encoded
+
+
+def decode_rows(rows):
+    """inverse of encode_rows"""
+    return {key: base64.b64decode(val['base64'])
+            if isinstance(val, dict) else val
+            for key, val in rows.items()}
+
+
+class Manifest:
+
+    """outputs of a sub command along with the state of their inputs"""
+
+    def __init__(self, args, sub_cmd, ignore=()):
+        """read the manifest of args.outname if args.incremental"""
+        self.args = args
+        self.sub_cmd = sub_cmd
+        self.ignore = ignore
+        self.enabled = args.incremental
+        self.fname = args.outname + '_manifest.json'
+        self._entries = self._read() if self.enabled else {}
+        self._recorded = {}
+        self._listings = {}
+        self._mtimes = {}
+
+    def _read(self):
+        """entries of the manifest file"""
+        if not os.path.isfile(self.fname):
+            return {}
+        with open(self.fname) as fid:
+            return json.load(fid)
+
+    def _mtime(self, fname):
+        """modification time of an input, 0 if it doesn't exist"""
+        if fname not in self._mtimes:
+            try:
+                self._mtimes[fname] = os.stat(fname).st_mtime_ns
+            except OSError:
+                self._mtimes[fname] = 0
+        return self._mtimes[fname]
+
+    def _exists(self, fname):
+        """whether fname exists, directories are listed only once"""
+        dirname, base = os.path.split(os.path.abspath(fname))
+        if dirname not in self._listings:
+            try:
+                self._listings[dirname] = set(os.listdir(dirname))
+            except OSError:
+                self._listings[dirname] = set()
+        return base in self._listings[dirname]
+
+    def _inputs(self, inputs):
+        """inputs and par file"""
+        return list(inputs) + [os.path.join(self.args.path, 'par')]
+
+    def up_to_date(self, output, inputs, extra=None):
+        """whether output doesn't need to be produced again
+
+        extra is any json serializable value output depends on
+        """
+        if not self.enabled:
+            return False
+        entry = self._entries.get(output)
+        if entry is None or not self._exists(output):
+            return False
+        if entry['options'] != options_hash(self.args, self.sub_cmd,
+                                            self.ignore, extra):
+            return False
+        return all(self._mtime(fname) <= entry['written']
+                   for fname in self._inputs(inputs))
+
+    def data(self, output):
+        """data recorded along with output"""
+        return self._entries[output].get('data')
+
+    def record(self, output, extra=None, data=None):
+        """output has just been written
+
+        data is any json serializable value to be recorded with it
+        """
+        if not self.enabled:
+            return
+        entry = {'written': os.stat(output).st_mtime_ns,
+                 'options': options_hash(self.args, self.sub_cmd,
+                                         self.ignore, extra)}
+        if data is not None:
+            entry['data'] = data
+        self._entries[output] = entry
+        self._recorded[output] = entry
+
+    def save(self):
+        """add recorded outputs to the manifest file
+
+        the file is read again since other sub commands (see batch) may
+        have recorded their outputs in the meantime
+        """
+        if not self._recorded:
+            return
+        entries = self._read()
+        entries.update(self._recorded)
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(entries, fid)
+        os.replace(tmp, self.fname)
+        self._recorded = {}
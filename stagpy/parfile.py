@@ -1,10 +1,13 @@
 """StagYY par file handling"""
 
-import f90nml
+from copy import deepcopy
+import hashlib
 import os.path
+import pickle
 from .constants import CONFIG_DIR
 
 PAR_DFLT_FILE = os.path.join(CONFIG_DIR, 'par')
+PAR_CACHE_DIR = os.path.join(CONFIG_DIR, 'par_cache')
 PAR_DEFAULT = {
     'switches': {
         'verbose': False,
@@ -596,27 +599,117 @@ PAR_DEFAULT = {
 
 
 def _write_default():
-    """create default par file"""
+    """create default par file
+
+    the in memory defaults are used if it cannot be written
+    """
     if not os.path.isfile(PAR_DFLT_FILE):
-        f90nml.write(PAR_DEFAULT, PAR_DFLT_FILE)
+        import f90nml
+        try:
+            os.makedirs(CONFIG_DIR, exist_ok=True)
+            f90nml.write(PAR_DEFAULT, PAR_DFLT_FILE)
+        except OSError:
+            pass
 
 
 def _read_default():
     """read default par file"""
+    import f90nml
     _write_default()
+    if not os.path.isfile(PAR_DFLT_FILE):
+        return f90nml.Namelist(deepcopy(PAR_DEFAULT))
     return f90nml.read(PAR_DFLT_FILE)
 
 
+def _file_key(fname, old_key=None):
+    """identify content of a file by its mtime, size and hash
+
+    the hash is only computed if mtime or size differ from old_key
+    """
+    if not os.path.isfile(fname):
+        return None
+    stat = os.stat(fname)
+    if old_key is not None and old_key[:2] == (stat.st_mtime_ns,
+                                               stat.st_size):
+        return old_key
+    with open(fname, 'rb') as fid:
+        digest = hashlib.sha1(fid.read()).hexdigest()
+    return stat.st_mtime_ns, stat.st_size, digest
+
+
+def _cache_name(par_file):
+    """name of cache file of a par file"""
+    path_hash = hashlib.sha1(os.path.abspath(par_file).encode()).hexdigest()
+    return os.path.join(PAR_CACHE_DIR, path_hash + '.pickle')
+
+
+def _read_cache(cache_file, par_file):
+    """merged namelist from cache if still valid
+
+    return the namelist (None if the cache is outdated) and the keys of
+    the default and run par files
+    """
+    old_keys = None, None
+    cached = None
+    try:
+        with open(cache_file, 'rb') as fid:
+            old_keys, cached = pickle.load(fid)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+    keys = (_file_key(PAR_DFLT_FILE, old_keys[0]),
+            _file_key(par_file, old_keys[1]))
+    # same content, the mtimes are refreshed if needed
+    if cached is not None and [key and key[2] for key in keys] == \
+            [key and key[2] for key in old_keys]:
+        if keys != old_keys:
+            _write_cache(cache_file, keys, cached)
+        return cached, keys
+    return None, keys
+
+
+def _write_cache(cache_file, keys, par_nml):
+    """atomically write merged namelist to cache
+
+    the cache is only an optimization, nothing is done if it cannot be
+    written
+    """
+    tmp_file = cache_file + '.{}'.format(os.getpid())
+    try:
+        os.makedirs(PAR_CACHE_DIR, exist_ok=True)
+        with open(tmp_file, 'wb') as fid:
+            pickle.dump((keys, par_nml), fid, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+
+
 def readpar(args):
-    """read StagYY par file"""
+    """read StagYY par file
+
+    the merged namelist is cached, parsing is skipped as long as the
+    default and run par files are not modified
+    """
     par_file = os.path.join(args.path, 'par')
+    if not os.path.isfile(par_file) and not any(
+            getattr(args, opt, False) for opt in ('create', 'update', 'edit')):
+        print('no par file found, check path')
+    _write_default()
+    cache_file = _cache_name(par_file)
+    par_nml, keys = _read_cache(cache_file, par_file)
+    if par_nml is not None:
+        return par_nml
+    par_nml = _parse_par(par_file)
+    _write_cache(cache_file, keys, par_nml)
+    return par_nml
+
+
+def _parse_par(par_file):
+    """parse and merge default and run par files"""
+    import f90nml
     par_dflt = _read_default()
     if os.path.isfile(par_file):
         par_nml = f90nml.read(par_file)
         for section in par_nml:
             par_dflt[section].update(par_nml[section])
-    else:
-        if not (args.create or args.update or args.edit):
-            print('no par file found, check path')
-    par_nml = par_dflt
-    return par_nml
+    return par_dflt
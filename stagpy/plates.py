@@ -4,17 +4,65 @@ Date: 2016/26/01
 """
 import numpy as np
 import sys
-from . import constants, misc
-from .stagdata import BinData, RprofData, TimeData
+from . import constants, misc, timing, watch
+from .stagdata import BinData, RprofData, TimeData, load
 from .field import plot_scalar
+from .manifest import Manifest, decode_rows, encode_rows
 from scipy.signal import argrelextrema
 from copy import deepcopy
+from io import StringIO
+from multiprocessing import Pool
+import argparse
+import os
 import os.path
 
+RESULTS_HEADERS = (
+    ('velocity', 'results_plate_velocity_{}_{}_{}.dat',
+     '# it  time  ph_trench vel_trench age_trench\n'),
+    ('subd', 'results_distance_subd_{}_{}_{}.dat',
+     '#  it      time   time [My]   distance     ph_trench     ph_cont  '
+     'age_trench [My] \n'),
+    ('continents', 'results_continents_{}_{}_{}.dat', ''),
+)
+RESULTS_BINARY = (
+    ('plates', 'results_plates_{}_{}_{}.npy'),
+    ('continents_map', 'results_continents_map_{}_{}_{}.npy'),
+)
+RESULTS_KEYS = tuple(res[0] for res in RESULTS_HEADERS + RESULTS_BINARY)
+# one record per trench
+PLATES_DTYPE = np.dtype([
+    ('timestep', '<i8'),
+    ('time', '<f8'),
+    ('time_my', '<f8'),
+    ('phi', '<f8'),
+    ('velocity', '<f8'),
+    ('age', '<f8'),
+    ('distance', '<f8'),
+    ('phi_cont', '<f8'),
+])
+CHECKPOINT_NAME = 'results_checkpoint_{}_{}_{}.dat'
+# suffix of binary results files while the analysis is running
+PART_SUFFIX = '.part'
+
+
+def continents_dtype(nphi):
+    """dtype of continents map records, one record per snapshot"""
+    return np.dtype([
+        ('nphi', '<i8'),
+        ('timestep', '<i8'),
+        ('time_my', '<f8'),
+        ('continents', '?', (nphi,)),
+    ])
+
 
 def detect_plates_vzcheck(stagdat_t, stagdat_vp, stagdat_h, rprof_data,
-                          args, seuil_memz):
-    """detect plates and check with vz and plate size"""
+                          args):
+    """detect plates and check with plate size
+
+    the vertical velocity check depends on the previous timesteps and is
+    performed afterwards by filter_limits_vz, this function returns
+    the mean vertical velocity below each candidate plate limit.
+    """
     v_z = stagdat_vp.fields['w']
     v_x = stagdat_vp.fields['v']
     h2o = stagdat_h.fields['h']
@@ -111,11 +159,10 @@ def detect_plates_vzcheck(stagdat_t, stagdat_vp, stagdat_h, rprof_data,
                 limits.append(phi)
         print(limits)
 
-        # verifying vertical speed
-        k = 0
-        for i in range(len(limits)):
+        # mean vertical speed below plate limits
+        vzms = []
+        for phi in limits:
             vzm = 0
-            phi = limits[i - k]
             if phi == nphi - 1:
                 for i_z in range(1, n_z):
                     vzm += (abs(v_z[i_z, phi, 0]) +
@@ -126,18 +173,31 @@ def detect_plates_vzcheck(stagdat_t, stagdat_vp, stagdat_h, rprof_data,
                     vzm += (abs(v_z[i_z, phi, 0]) +
                             abs(v_z[i_z, phi - 1, 0]) +
                             abs(v_z[i_z, phi + 1, 0])) / (n_z * 3)
+            vzms.append(vzm)
+    return (limits, vzms, vz_mean, nphi, dvphi, v_x[n_z - 1, :, 0],
+            water_profile)
 
-            if seuil_memz != 0:
-                vz_thres = vz_mean * 0.1 + seuil_memz / 2
-            else:
-                vz_thres = vz_mean * 0
-            if vzm < vz_thres:
-                limits.remove(phi)
-                k += 1
-        print(limits)
 
+def filter_limits_vz(detections):
+    """check plate limits with vertical speed
+
+    detections are the outputs of detect_plates_vzcheck in timestep order.
+    The vertical speed threshold of a timestep depends on the one of the
+    previous timestep, this is the only sequential part of the analysis.
+
+    yield the plate limits of each timestep
+    """
+    seuil_memz = 0
+    for limits, vzms, vz_mean, _, _, _, _ in detections:
+        if seuil_memz != 0:
+            vz_thres = vz_mean * 0.1 + seuil_memz / 2
+        else:
+            vz_thres = 0
+        limits = [phi for phi, vzm in zip(limits, vzms) if vzm >= vz_thres]
+        print(limits)
         print('\n')
-    return limits, nphi, dvphi, vz_thres, v_x[n_z - 1, :, 0], water_profile
+        seuil_memz = vz_thres
+        yield limits
 
 
 def detect_plates(args, velocity, age, vrms_surface,
@@ -215,7 +275,7 @@ def detect_plates(args, velocity, age, vrms_surface,
             agetrench[itrench]
         ))
 
-    return trench, ridge, agetrench, dv_trench, dv_ridge
+    return trench, ridge, agetrench, dv_trench, dv_ridge, velocity_trench
 
 
 def plot_plates(args, velocity, temp, conc, age, timestep, time, vrms_surface,
@@ -593,7 +653,324 @@ def plot_plates(args, velocity, temp, conc, age, timestep, time, vrms_surface,
         file_continents.writelines(["%4.3s" % item for item in concfld[indcont, :-1]])
         file_continents.writelines(["\n"])
 
-    return None
+    return distance_subd, ph_cont_subd, ~np.ma.getmaskarray(continents)
+
+
+def _finished(args, manifest, timestep, vrms_surface, committed=False):
+    """whether a previous run finished the analysis of timestep
+
+    This is what both the checkpoint of a resumed analysis (see _resume)
+    and the manifest of args.incremental rely on.  committed timesteps
+    have their rows in the results files.  Others are finished if their
+    rows are recorded in the manifest.  Either way, with args.incremental
+    the outputs of a finished timestep have to be up to date.
+
+    return whether timestep is finished, and its rows if they are to be
+    read from the manifest.
+    """
+    if args.incremental:
+        output, inputs = _timestep_files(args, timestep)
+        if not manifest.up_to_date(output, inputs, vrms_surface):
+            return False, None
+        if not committed:
+            return True, decode_rows(manifest.data(output))
+    return committed, None
+
+
+def _resume(fnames, chk_name, finished):
+    """prepare results files to resume an interrupted analysis
+
+    Binary results already converted to npy files by _finalize_binary are
+    written back to their raw files, new timesteps are appended to them.
+    The checkpoint lists processed timesteps along with the sizes of the
+    results files once their rows were written, -1 for files not in use.
+    Timesteps are kept as long as their rows are in all the results files
+    of fnames and finished(timestep) holds.  Results files are truncated
+    to their size at the last timestep kept, discarding rows of the
+    following ones.
+
+    return the set of timesteps kept, None if there is none.
+    """
+    for key, _ in RESULTS_BINARY:
+        part = fnames.get(key)
+        if part is None or os.path.isfile(part):
+            continue
+        npy = part[:-len(PART_SUFFIX)]
+        if os.path.isfile(npy):
+            np.load(npy).tofile(part)
+    if not os.path.isfile(chk_name):
+        return None
+    done = set()
+    sizes = None
+    chk_size = 0
+    with open(chk_name, 'rb') as chk:
+        for line in chk:
+            if not line.endswith(b'\n'):
+                # checkpoint line interrupted while written
+                break
+            values = list(map(int, line.split()))
+            line_sizes = dict(zip(RESULTS_KEYS, values[1:]))
+            if not all(0 <= line_sizes.get(key, -1) and
+                       os.path.isfile(fname) and
+                       line_sizes[key] <= os.path.getsize(fname)
+                       for key, fname in fnames.items()):
+                break
+            if not finished(values[0]):
+                break
+            chk_size += len(line)
+            done.add(values[0])
+            sizes = line_sizes
+    with open(chk_name, 'r+b') as chk:
+        chk.truncate(chk_size)
+    if sizes is None:
+        return None
+    for key, fname in fnames.items():
+        with open(fname, 'r+b') as fid:
+            fid.truncate(sizes[key])
+    return done
+
+
+def _commit_results(files_results, rows, file_chk, timestep):
+    """append results of one timestep and record it in the checkpoint"""
+    sizes = []
+    for key in RESULTS_KEYS:
+        fid = files_results.get(key)
+        if fid is None:
+            sizes.append(-1)
+            continue
+        fid.write(rows[key])
+        fid.flush()
+        os.fsync(fid.fileno())
+        sizes.append(os.fstat(fid.fileno()).st_size)
+    file_chk.write(' '.join(map(str, [timestep] + sizes)) + '\n')
+    file_chk.flush()
+    os.fsync(file_chk.fileno())
+
+
+def _finalize_binary(fnames, appended=True):
+    """write binary results as npy files
+
+    binary results are appended to raw files while the analysis is
+    running, they are converted in bulk to npy files once every timestep
+    is processed.  These can be read with np.load(name, mmap_mode='r').
+    Existing npy files are kept as is if nothing has been appended.
+    """
+    for key, _ in RESULTS_BINARY:
+        part = fnames.get(key)
+        if part is None or not os.path.isfile(part):
+            continue
+        if not appended and os.path.isfile(part[:-len(PART_SUFFIX)]):
+            os.remove(part)
+            continue
+        if key == 'plates':
+            dtype = PLATES_DTYPE
+        else:
+            nphi = np.fromfile(part, dtype='<i8', count=1)
+            dtype = continents_dtype(nphi[0] if nphi.size else 0)
+        np.save(part[:-len(PART_SUFFIX)], np.fromfile(part, dtype=dtype))
+        os.remove(part)
+
+
+def _with_continents(args):
+    """whether continents are written in results"""
+    spherical = args.par_nml['geometry']['shape'].lower() == 'spherical'
+    return args.par_nml['switches']['cont_tracers'] and spherical
+
+
+def _vrms_surface(args, rprof_data):
+    """averaged horizontal surface velocity
+
+    needed for redimensionalisation, computed with mean profiles
+    """
+    data, tsteps = rprof_data.data, rprof_data.tsteps
+    meta = constants.RPROF_VAR_LIST['u']
+    cols = [meta.prof_idx]
+
+    def chunks(mydata, nbz):
+        """Divide vector mydata into an array"""
+        return [mydata[ii:ii + nbz]
+                for ii in range(0, len(mydata), nbz)]
+    nztot = int(np.shape(data)[0] / (np.shape(tsteps)[0]))
+    radius = np.array(chunks(np.array(data[:, 0], float), nztot))
+    donnee = np.array(data[:, cols], float)
+    donnee_chunk = chunks(donnee, nztot)
+    donnee_averaged = np.mean(donnee_chunk, axis=0)
+    if args.par_nml['boundaries']['air_layer']:
+        dsa = args.par_nml['boundaries']['air_thickness']
+        myarg = np.argmin(abs(radius[0, :] - radius[0, -1] + dsa))
+    else:
+        myarg = -1
+    return donnee_averaged[myarg, 0]
+
+
+# state of a process treating timesteps, see _map_timesteps
+_WORKER = {}
+
+
+def _init_worker(args):
+    """set up a process treating timesteps"""
+    if not hasattr(args, 'plt'):
+        misc.plot_backend(args)
+    _WORKER['args'] = args
+    _WORKER['rprof'] = load(args, RprofData) if args.vzcheck else None
+
+
+def _map_timesteps(args, func, iterable):
+    """apply func to each item of iterable with args.jobs processes
+
+    results are yielded in the order of iterable
+    """
+    if args.jobs > 1:
+        # modules can't be sent to other processes
+        wargs = argparse.Namespace(**{
+            key: val for key, val in vars(args).items()
+            if key not in ('mpl', 'plt', 'sns', 'func', 'cache')})
+        with Pool(args.jobs, _init_worker, (wargs,)) as pool:
+            yield from pool.imap(func, iterable)
+    else:
+        _init_worker(args)
+        yield from map(func, iterable)
+
+
+def _vzcheck_detect(timestep):
+    """detect plate limits candidates at one timestep"""
+    args = _WORKER['args']
+    print('Treating timestep', timestep)
+    velocity = load(args, BinData, 'v', timestep)
+    temp = load(args, BinData, 't', timestep)
+    water = load(args, BinData, 'h', timestep)
+    return detect_plates_vzcheck(temp, velocity, water, _WORKER['rprof'],
+                                 args)
+
+
+def _vzcheck_plot(item):
+    """plot plate limits at one timestep"""
+    timestep, limits, detection = item
+    _, _, _, nphi, dvphi, vphi_surf, water_profile = detection
+    plt = _WORKER['args'].plt
+    limits = sorted(limits)
+    sizeplates = [limits[0] + nphi - limits[-1]]
+    for lim in range(1, len(limits)):
+        sizeplates.append(limits[lim] - limits[lim - 1])
+    lim = len(limits) * [max(dvphi)]
+    plt.figure(timestep)
+    plt.subplot(221)
+    plt.axis([0, nphi, np.min(vphi_surf) * 1.2, np.max(vphi_surf) * 1.2])
+    plt.plot(vphi_surf)
+    plt.subplot(223)
+    plt.axis([0, nphi, np.min(dvphi) * 1.2, np.max(dvphi) * 1.2])
+    plt.plot(dvphi)
+    plt.scatter(limits, lim, color='red')
+    plt.subplot(222)
+    plt.hist(sizeplates, 10, (0, nphi / 2))
+    plt.subplot(224)
+    plt.plot(water_profile)
+    plt.savefig('plates' + str(timestep) + '.pdf', format='PDF')
+    plt.close(timestep)
+
+
+# field variables read by the plate analysis, see _timestep_files
+WATCHED_VARS = ('v', 't', 'c', 'n', 'a')
+
+
+def _timestep_files(args, timestep):
+    """output and inputs of the plate analysis of one timestep
+
+    the viscosity plot is the last output of a timestep, it stands for
+    all of them in the manifest
+    """
+    output = misc.out_name(args, 'n').format(timestep) + '.pdf'
+    inputs = [misc.stag_file(args, par_type, timestep)
+              for par_type in ('vp', 't', 'c', 'eta', 'age')]
+    inputs.append(misc.stag_file(args, 'sc', timestep, '.dat'))
+    return output, inputs
+
+
+def _plates_timestep(item):
+    """plate analysis of one timestep
+
+    return the rows to append to each results file
+    """
+    ttransit = 1.78e15  # My; Earth transit time
+    yearins = 2.16E7
+
+    timestep, vrms_surface = item
+    args = _WORKER['args']
+    velocity = load(args, BinData, 'v', timestep)
+    temp = load(args, BinData, 't', timestep)
+    print('Treating timestep', timestep)
+    conc = load(args, BinData, 'c', timestep)
+    viscosity = load(args, BinData, 'n', timestep)
+    age = load(args, BinData, 'a', timestep)
+
+    time = temp.ti_ad * vrms_surface * ttransit / yearins / 1.e6
+    # results of this timestep are buffered and only appended to
+    # the files once the timestep is fully processed
+    buffers = {key: StringIO() for key, _, _ in RESULTS_HEADERS}
+    if not _with_continents(args):
+        buffers['continents'] = None
+    with timing.stage('derived', timestep):
+        trenches, ridges, agetrenches, dv_trench, dv_ridge, vel_trenches =\
+            detect_plates(args, velocity,
+                          age, vrms_surface,
+                          buffers['velocity'], timestep, time)
+    with timing.stage('render', timestep):
+        distances, ph_conts, continents = \
+            plot_plates(args, velocity, temp, conc, age, timestep, time,
+                        vrms_surface, trenches, ridges, agetrenches,
+                        dv_trench, dv_ridge,
+                        buffers['subd'], buffers['continents'])
+    rows = {key: None if buf is None else buf.getvalue()
+            for key, buf in buffers.items()}
+    if args.binary:
+        plates = np.zeros(len(trenches), dtype=PLATES_DTYPE)
+        plates['timestep'] = timestep
+        plates['time'] = velocity.ti_ad
+        plates['time_my'] = time
+        plates['phi'] = trenches
+        plates['velocity'] = vel_trenches
+        plates['age'] = np.ma.filled(agetrenches, np.nan).ravel()
+        plates['distance'] = distances
+        plates['phi_cont'] = ph_conts
+        rows['plates'] = plates.tobytes()
+        cont_map = np.zeros(1, dtype=continents_dtype(len(continents)))
+        cont_map['nphi'] = len(continents)
+        cont_map['timestep'] = timestep
+        cont_map['time_my'] = time
+        cont_map['continents'] = continents
+        rows['continents_map'] = cont_map.tobytes()
+
+    # plot viscosity field with position of trenches and ridges
+    with timing.stage('render', timestep):
+        fig, axis, surf = plot_scalar(args, viscosity, 'n')
+        etamax = args.par_nml['viscosity']['eta_max']
+        surf.set_clim(vmin=1e-2, vmax=etamax)
+        args.plt.figure(fig.number)
+        axis.text(1., 0.9, str(round(time, 0)) + ' My',
+                  transform=axis.transAxes, fontsize=args.fontsize)
+        axis.text(1., 0.1, str(timestep),
+                  transform=axis.transAxes, fontsize=args.fontsize)
+        for itr in np.arange(len(trenches)):
+            xxd = (viscosity.rcmb + 1.02) * np.cos(trenches[itr])
+            yyd = (viscosity.rcmb + 1.02) * np.sin(trenches[itr])
+            xxt = (viscosity.rcmb + 1.35) * np.cos(trenches[itr])
+            yyt = (viscosity.rcmb + 1.35) * np.sin(trenches[itr])
+            axis.annotate('', xy=(xxd, yyd), xytext=(xxt, yyt),
+                          arrowprops=dict(facecolor='red', shrink=0.05))
+        for iri in np.arange(len(ridges)):
+            xxd = (viscosity.rcmb + 1.02) * np.cos(ridges[iri])
+            yyd = (viscosity.rcmb + 1.02) * np.sin(ridges[iri])
+            xxt = (viscosity.rcmb + 1.35) * np.cos(ridges[iri])
+            yyt = (viscosity.rcmb + 1.35) * np.sin(ridges[iri])
+            axis.annotate('', xy=(xxd, yyd), xytext=(xxt, yyt),
+                          arrowprops=dict(facecolor='green', shrink=0.05))
+        args.plt.tight_layout()
+    with timing.stage('savefig', timestep):
+        args.plt.savefig(
+            misc.out_name(args, 'n').format(viscosity.step) + '.pdf',
+            format='PDF')
+    args.plt.close(fig)
+    return rows
 
 
 def plates_cmd(args):
@@ -601,165 +978,137 @@ def plates_cmd(args):
 
     uses velocity field (velocity derivation)
     plots the number of plates over a designated lapse of time
+
+    timesteps are treated in parallel with args.jobs processes, with
+    args.incremental the ones whose plots are up to date are skipped and
+    their results are read from the manifest
     """
+    for _ in plates_steps(args):
+        pass
 
-    ttransit = 1.78e15  # My; Earth transit time
-    yearins = 2.16E7
+
+def plates_steps(args):
+    """plate analysis, yield each timestep once its results are written
+
+    see plates_cmd
+    """
+    plt = args.plt
+    timesteps = range(*args.timestep)
 
     if args.vzcheck:
-        seuil_memz = 0
-        nb_plates = []
-        timedat = TimeData(args)
+        timedat = load(args, TimeData)
         slc = slice(*(i * args.par_nml['ioin']['save_file_framestep']
                       for i in args.timestep))
         time, ch2o = timedat.data[:, 1][slc], timedat.data[:, 27][slc]
-    else:
-        if not os.path.exists('results_plate_velocity_{}_{}_{}.dat'.format(*args.timestep)):
-            file_results = open(
-                'results_plate_velocity_{}_{}_{}.dat'.format(*args.timestep),
-                'w')
-            file_results.write('# it  time  ph_trench vel_trench age_trench\n')
-            file_results_subd = open(
-                'results_distance_subd_{}_{}_{}.dat'.format(*args.timestep),
-                'w')
-            file_results_subd.write(
-                '#  it      time   time [My]   distance     ph_trench     ph_cont  age_trench [My] \n')
-            spherical = args.par_nml['geometry']['shape'].lower() == 'spherical'
-            if args.par_nml['switches']['cont_tracers'] and spherical:
-                file_continents = open(
-                     'results_continents_{}_{}_{}.dat'.format(*args.timestep), 'w')
-            else:
-                file_continents = None
-        else:
-            print(' *WARNING* ')
-            print(' The files with results',
-                  'results_distance_subd_{}_{}_{}.dat'.format(*args.timestep),
-                  'cannot be overwritten')
-            print(' Exiting the code ')
-            sys.exit()
-
-    for timestep in range(*args.timestep):
-        velocity = BinData(args, 'v', timestep)
-        temp = BinData(args, 't', timestep)
-        rprof_data = RprofData(args)
-        print('Treating timestep', timestep)
-        if args.vzcheck:
-            water = BinData(args, 'h', timestep)
-            rprof_data = RprofData(args)
-            plt = args.plt
-            limits, nphi, dvphi, seuil_memz, vphi_surf, water_profile =\
-                detect_plates_vzcheck(temp, velocity, water, rprof_data,
-                                      args, seuil_memz)
-            limits.sort()
-            sizeplates = [limits[0] + nphi - limits[-1]]
-            for lim in range(1, len(limits)):
-                sizeplates.append(limits[lim] - limits[lim - 1])
-            lim = len(limits) * [max(dvphi)]
-            plt.figure(timestep)
-            plt.subplot(221)
-            plt.axis([0, len(velocity.fields['w'][0]) - 1,
-                      np.min(vphi_surf) * 1.2, np.max(vphi_surf) * 1.2])
-            plt.plot(vphi_surf)
-            plt.subplot(223)
-            plt.axis(
-                [0, len(velocity.fields['w'][0]) - 1,
-                 np.min(dvphi) * 1.2, np.max(dvphi) * 1.2])
-            plt.plot(dvphi)
-            plt.scatter(limits, lim, color='red')
-            plt.subplot(222)
-            plt.hist(sizeplates, 10, (0, nphi / 2))
-            plt.subplot(224)
-            plt.plot(water_profile)
-            plt.savefig('plates' + str(timestep) + '.pdf', format='PDF')
-
-            nb_plates.append(len(limits))
-            plt.close(timestep)
+        detections = list(_map_timesteps(args, _vzcheck_detect, timesteps))
+        all_limits = list(filter_limits_vz(detections))
+        for _ in _map_timesteps(args, _vzcheck_plot,
+                                zip(timesteps, all_limits, detections)):
+            pass
+        nb_plates = [len(limits) for limits in all_limits]
+        if args.timeprofile:
+            for i in range(2, len(nb_plates) - 3):
+                nb_plates[i] = (nb_plates[i - 2] + nb_plates[i - 1] +
+                                nb_plates[i] + nb_plates[i + 1] +
+                                nb_plates[i + 2]) / 5
+            plt.figure(-1)
+            plt.subplot(121)
+            plt.axis([time[0], time[-1], 0, np.max(nb_plates)])
+            plt.plot(time, nb_plates)
+            plt.subplot(122)
+            plt.plot(time, ch2o)
+            plt.savefig('plates_{}_{}_{}.pdf'.format(*args.timestep),
+                        format='PDF')
+            plt.close(-1)
+        return
+
+    fnames = {key: name.format(*args.timestep)
+              for key, name, _ in RESULTS_HEADERS}
+    if args.binary:
+        fnames.update((key, name.format(*args.timestep) + PART_SUFFIX)
+                      for key, name in RESULTS_BINARY)
+    if not _with_continents(args):
+        del fnames['continents']
+    chk_name = CHECKPOINT_NAME.format(*args.timestep)
+    manifest = Manifest(args, 'plates')
+    rprof_mtime = os.stat(misc.stag_file(args, 'rprof.dat')).st_mtime_ns
+    vrms_surface = _vrms_surface(args, load(args, RprofData))
+    done = None
+    if args.resume:
+        done = _resume(fnames, chk_name, lambda timestep: _finished(
+            args, manifest, timestep, vrms_surface, committed=True)[0])
+    # an empty checkpoint means nothing was done, the analysis restarts
+    fresh = args.resume and os.path.isfile(chk_name)
+    if done is None and not fresh and os.path.exists(fnames['velocity']):
+        print(' *WARNING* ')
+        print(' The files with results', fnames['subd'],
+              'cannot be overwritten')
+        if args.resume:
+            print(' No checkpoint', chk_name, 'to resume from')
         else:
-            conc = BinData(args, 'c', timestep)
-            viscosity = BinData(args, 'n', timestep)
-            age = BinData(args, 'a', timestep)
-            rcmb = viscosity.rcmb
-
-            if timestep == args.timestep[0]:
-                # calculating averaged horizontal surface velocity
-                # needed for redimensionalisation
-                # using mean profiles
-                data, tsteps = rprof_data.data, rprof_data.tsteps
-                meta = constants.RPROF_VAR_LIST['u']
-                cols = [meta.prof_idx]
-
-                def chunks(mydata, nbz):
-                    """Divide vector mydata into an array"""
-                    return [mydata[ii:ii + nbz]
-                            for ii in range(0, len(mydata), nbz)]
-                nztot = int(np.shape(data)[0] / (np.shape(tsteps)[0]))
-                radius = np.array(chunks(np.array(data[:, 0], float) + rcmb,
-                                         nztot))
-                donnee = np.array(data[:, cols], float)
-                donnee_chunk = chunks(donnee, nztot)
-                donnee_averaged = np.mean(donnee_chunk, axis=0)
-                if args.par_nml['boundaries']['air_layer']:
-                    dsa = args.par_nml['boundaries']['air_thickness']
-                    myarg = np.argmin(abs(radius[0, :] - radius[0, -1] + dsa))
-                else:
-                    myarg = -1
-                vrms_surface = donnee_averaged[myarg, 0]
-
-            time = temp.ti_ad * vrms_surface * ttransit / yearins / 1.e6
-            trenches, ridges, agetrenches, dv_trench, dv_ridge =\
-                detect_plates(args, velocity,
-                              age, vrms_surface,
-                              file_results, timestep, time)
-            plot_plates(args, velocity, temp, conc, age, timestep, time,
-                        vrms_surface, trenches, ridges, agetrenches,
-                        dv_trench, dv_ridge,
-                        file_results_subd, file_continents)
-
-            # plot viscosity field with position of trenches and ridges
-            fig, axis, surf = plot_scalar(args, viscosity, 'n')
-            etamax = args.par_nml['viscosity']['eta_max']
-            surf.set_clim(vmin=1e-2, vmax=etamax)
-            args.plt.figure(fig.number)
-            axis.text(1., 0.9, str(round(time, 0)) + ' My',
-                      transform=axis.transAxes, fontsize=args.fontsize)
-            axis.text(1., 0.1, str(timestep),
-                      transform=axis.transAxes, fontsize=args.fontsize)
-            for itr in np.arange(len(trenches)):
-                xxd = (viscosity.rcmb + 1.02) * np.cos(trenches[itr])
-                yyd = (viscosity.rcmb + 1.02) * np.sin(trenches[itr])
-                xxt = (viscosity.rcmb + 1.35) * np.cos(trenches[itr])
-                yyt = (viscosity.rcmb + 1.35) * np.sin(trenches[itr])
-                axis.annotate('', xy=(xxd, yyd), xytext=(xxt, yyt),
-                              arrowprops=dict(facecolor='red', shrink=0.05))
-            for iri in np.arange(len(ridges)):
-                xxd = (viscosity.rcmb + 1.02) * np.cos(ridges[iri])
-                yyd = (viscosity.rcmb + 1.02) * np.sin(ridges[iri])
-                xxt = (viscosity.rcmb + 1.35) * np.cos(ridges[iri])
-                yyt = (viscosity.rcmb + 1.35) * np.sin(ridges[iri])
-                axis.annotate('', xy=(xxd, yyd), xytext=(xxt, yyt),
-                              arrowprops=dict(facecolor='green', shrink=0.05))
-            args.plt.tight_layout()
-            args.plt.savefig(
-                misc.out_name(args, 'n').format(viscosity.step) + '.pdf',
-                format='PDF')
-            args.plt.close(fig)
-
-    if args.timeprofile and args.vzcheck:
-        for i in range(2, len(nb_plates) - 3):
-            nb_plates[i] = (nb_plates[i - 2] + nb_plates[i - 1] +
-                            nb_plates[i] + nb_plates[i + 1] +
-                            nb_plates[i + 2]) / 5
-        plt.figure(-1)
-        plt.subplot(121)
-        plt.axis([time[0], time[-1], 0, np.max(nb_plates)])
-        plt.plot(time, nb_plates)
-        plt.subplot(122)
-        plt.plot(time, ch2o)
-        plt.savefig('plates_{}_{}_{}.pdf'.format(*args.timestep),
-                    format='PDF')
-        plt.close(-1)
-    else:
-        file_results.close()
-        file_results_subd.close()
-        if args.par_nml['switches']['cont_tracers'] and spherical:
-            file_continents.close()
+            print(' Use +resume to continue an interrupted analysis')
+        print(' Exiting the code ')
+        sys.exit()
+    mode = 'w' if done is None else 'a'
+    files_results = {}
+    for key, _, header in RESULTS_HEADERS:
+        if key not in fnames:
+            files_results[key] = None
+            continue
+        files_results[key] = open(fnames[key], mode)
+        if done is None:
+            files_results[key].write(header)
+    for key, _ in RESULTS_BINARY:
+        if key in fnames:
+            files_results[key] = open(fnames[key], mode + 'b')
+    file_chk = open(chk_name, mode)
+    if done is None:
+        done = set()
+    appended = False
+
+    for batch in watch.timesteps(args, WATCHED_VARS, (('sc', '.dat'),)):
+        # rprof.dat grows while StagYY runs (see watch)
+        mtime = os.stat(misc.stag_file(args, 'rprof.dat')).st_mtime_ns
+        if mtime != rprof_mtime:
+            if getattr(args, 'cache', None):
+                args.cache.forget(RprofData)
+            vrms_surface = _vrms_surface(args, load(args, RprofData))
+            rprof_mtime = mtime
+        todo = []
+        cached = {}
+        for timestep in batch:
+            if timestep in done:
+                # checked by _resume, its rows are in the results files
+                print('Skipping timestep', timestep, '(already processed)')
+                continue
+            finished, rows = _finished(args, manifest, timestep,
+                                       vrms_surface)
+            if finished:
+                cached[timestep] = rows
+            todo.append(timestep)
+        all_rows = _map_timesteps(args, _plates_timestep,
+                                  ((step, vrms_surface) for step in todo
+                                   if step not in cached))
+        # results are written in timestep order
+        for timestep in todo:
+            if timestep in cached:
+                print('Skipping timestep', timestep, '(up to date)')
+                rows = cached[timestep]
+            else:
+                rows = next(all_rows)
+                manifest.record(_timestep_files(args, timestep)[0],
+                                vrms_surface, encode_rows(rows))
+            # saved first, the rows of a timestep missing in the checkpoint
+            # are then still in the manifest
+            manifest.save()
+            _commit_results(files_results, rows, file_chk, timestep)
+            appended = True
+            yield timestep
+        # terminates the pool of workers of this batch
+        all_rows.close()
+
+    for fid in files_results.values():
+        if fid is not None:
+            fid.close()
+    file_chk.close()
+    _finalize_binary(fnames, appended)
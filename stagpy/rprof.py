@@ -4,20 +4,24 @@ Author: Stephane Labrosse with inputs from Martina Ulvrova and Adrien Morison
 Date: 2015/09/11
 """
 import numpy as np
-from scipy import integrate as itg
-import math
 from . import constants, misc
-from .stagdata import RprofData
+from .manifest import Manifest
+from .stagdata import (RprofData, RprofAverage, iter_rprof, load,
+                        profile_rows)
 from cycler import cycler
 
 
-def _normprof(rrr, func):  # for args.plot_difference
-    """Volumetric norm of a profile
+def _normprofs(rrr, func, npts):  # for args.plot_difference
+    """Volumetric norm of several profiles
 
-    Two arrays: rrr is the radius position and f the function.
+    Two 2D arrays (profile, point): rrr is the radius position and f the
+    function, padded with NaN beyond the npts first points.
     """
-    norm = 3. / (rrr[-1]**3 - rrr[0]**3) * itg.trapz(func**2 * rrr**2, rrr)
-    return norm
+    iprof = np.arange(npts.size)
+    integrand = func**2 * rrr**2
+    integral = np.nansum((integrand[:, 1:] + integrand[:, :-1]) *
+                         np.diff(rrr) / 2, axis=1)
+    return 3. / (rrr[iprof, npts - 1]**3 - rrr[:, 0]**3) * integral
 
 
 def _extrap(xpos, xpoints, ypoints):  # for args.plot_difference
@@ -35,23 +39,84 @@ def _extrap(xpos, xpoints, ypoints):  # for args.plot_difference
     return ypos
 
 
-def _calc_energy(data, ir0, ir1):  # for args.plot_energy
-    """Compute energy balance(r)"""
-    zgrid = np.array(data[ir0:ir1, 63], float)
-    zgrid = np.append(zgrid, 1.)
-    dzg = np.array(data[ir0 + 1:ir1, 0], float)\
-        - np.array(data[ir0:ir1 - 1, 0], float)
-    qadv = np.array(data[ir0:ir1 - 1, 60], float)
-    qadv = np.insert(qadv, 0, 0.)
-    qadv = np.append(qadv, 0.)
-    qcond = (np.array(data[ir0:ir1 - 1, 1], float) -
-             np.array(data[ir0 + 1:ir1, 1], float)) / dzg
-    qcond0 = (1. - float(data[ir0, 1])) / float(data[ir0, 0])
-    qtop = float(data[ir1, 1]) / (1. - float(data[ir1, 0]))
-    qcond = np.insert(qcond, 0, qcond0)
-    qcond = np.append(qcond, qtop)
-    qtot = qadv + qcond
-    return qtot, qadv, qcond, zgrid
+def overturn_diagnostic(rprof_data, steps, rbounds):
+    """differences to the overturned initial profiles
+
+    Temperature and concentration profiles of the requested steps are
+    compared to the overturned version of the first ones, all the steps
+    being processed at once.  The growth rate of the maximum rms vertical
+    velocity is fitted with least squares on the log of the velocity
+    until three steps before its maximum.
+
+    Return a dict with the time, norms of the temperature and
+    concentration differences and maximum velocity of each step, indices
+    of minimum differences and of maximum velocity, and fitted growth
+    rate sigma and initial velocity w0.
+    """
+    rmin, rmax, rcmb = rbounds
+    profs, npts = rprof_data.profiles([0, 1, 36, 7], steps)
+    # last point of profiles is left out as in plotprofiles
+    npts = npts - 1
+    profs[np.arange(npts.size), npts] = np.nan
+    radius = profs[:, :, 0] + rcmb
+    rfin = (rmax**3 + rmin**3 - radius**3)**(1 / 3)
+    ref = radius[0, :npts[0]]
+    diag = {'time': rprof_data.tsteps[steps, 2]}
+    for name, icol in (('tempdif', 1), ('concdif', 2)):
+        init = _extrap(np.nan_to_num(rfin.ravel()), ref,
+                       profs[0, :npts[0], icol]).reshape(rfin.shape)
+        diag[name] = _normprofs(radius, profs[:, :, icol] - init, npts)
+    diag['wmax'] = np.nanmax(profs[:, :, 3], axis=1)
+    diag['imint'] = int(np.argmin(diag['tempdif']))
+    diag['iminc'] = int(np.argmin(diag['concdif']))
+    diag['iwm'] = int(np.argmax(diag['wmax']))
+    nfit = diag['iwm'] - 2
+    if nfit > 1:
+        diag['sigma'], logw0 = np.polyfit(diag['time'][:nfit],
+                                          np.log(diag['wmax'][:nfit]), 1)
+        diag['w0'] = np.exp(logw0)
+    else:
+        diag['sigma'], diag['w0'] = np.nan, diag['wmax'][0]
+    return diag
+
+
+def write_overturn(fname, diag):
+    """write overturn diagnostic in a text file
+
+    scalars are in commented header lines, followed by one line per step
+    """
+    with open(fname, 'w') as fich:
+        for key in ('imint', 'iminc', 'iwm', 'sigma', 'w0'):
+            fich.write('# {} = {}\n'.format(key, diag[key]))
+        cols = ('time', 'tempdif', 'concdif', 'wmax')
+        fich.write('#' + ''.join('{:>15}'.format(col) for col in cols) + '\n')
+        for row in zip(*(diag[col] for col in cols)):
+            fich.write(' ' + ''.join('{:15.7e}'.format(val) for val in row) +
+                       '\n')
+
+
+def plot_overturn(diag, axax):
+    """plot time series of difference profiles"""
+    time = diag['time']
+    for axis, name, label, iname in ((axax[0], 'concdif', 'Composition diff.',
+                                      'iminc'),
+                                     (axax[1], 'tempdif', 'Temperature diff.',
+                                      'imint')):
+        imin = diag[iname]
+        axis.semilogy(time, diag[name] / diag[name][0])
+        axis.semilogy(time[imin], diag[name][imin] / diag[name][0],
+                      'o', label=fmttime(time[imin]))
+        axis.set_ylabel(label)
+    axax[0].legend(loc='upper right')
+    axax[1].legend(loc='lower right')
+    # maximum velocity as function of time
+    axax[2].semilogy(time, diag['wmax'])
+    axax[2].set_ylabel('Max. rms vert. velocity')
+    axax[2].set_xlabel('Time')
+    tfit = time[:diag['iwm'] + 2]
+    axax[2].semilogy(tfit, diag['w0'] * np.exp(diag['sigma'] * tfit),
+                     linestyle='--', label=r'$sigma=%.2e$' % diag['sigma'])
+    axax[2].legend(loc='upper right')
 
 
 def fmttime(tin):
@@ -61,21 +126,41 @@ def fmttime(tin):
     return r'$t={} \times 10^{{{}}}$'.format(aaa, bbb)
 
 
+def profiles_figname(quant, args):
+    """name of the figure saved by plotprofiles"""
+    timename = '{}_{}_{}'.format(args.timestep[0], args.timestep[1] - 1,
+                                 args.timestep[2])
+    if quant[0] == 'Grid km':
+        return 'Gridkm' + timename + '.pdf'
+    return quant[0].replace(' ', '_') + timename + '.pdf'
+
+
+def averaged_figname(quant):
+    """name of the figure saved by plotaveragedprofiles"""
+    return 'fig_average' + quant[0].replace(' ', '_') + '.pdf'
+
+
 def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
-                 ctheoarg, integrate=False):
+                 ctheoarg, integrate=False, energy=None):
     """Plot the chosen profiles for the chosen timesteps
 
     quant holds the strings for the x axis annotation and
     the legends for the additional profiles
 
     vartuple contains the numbers of the column to be plotted
+
+    with args.batchplot, profiles are drawn as one LineCollection
+    per column instead of one line per time step
+
+    energy holds the heat fluxes computed by RprofData.energy for the
+    plotted time steps
     """
     plt = args.plt
     istart, ilast, istep = args.timestep
     lwdth = args.linewidth
     ftsz = args.fontsize
     rmin, rmax, rcmb = rbounds
-    axax, initprof = ctheoarg
+    initprof = ctheoarg[1]
     linestyles = ('-', '--', '-.', ':')
 
     if integrate:
@@ -88,34 +173,19 @@ def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
     else:
         fig, axe = plt.subplots()
 
-    timename = str(istart) + "_" + str(ilast - 1) + "_" + str(istep)
-    if args.plot_difference:
-        concdif = []
-        tempdif = []
-        wmax = []
-
     # this is from http://stackoverflow.com/questions/4805048/
     # how-to-get-different-colored-lines-for-different-plots-in-a-single-figure
-    num_plots = (ilast - istart - 1) / istep + 1
+    steps = range(istart + 1, ilast + 1, istep)
     colormap = plt.cm.winter_r
-    plt.gca().set_prop_cycle(cycler('color', [colormap(i)
-                             for i in np.linspace(0, 0.9, num_plots)]))
-
-    for step in range(istart + 1, ilast + 1, istep):
-        # find the indices
-        # 1 - positions the step within the range of timesteps where
-        # the number of points changes
-        ann = sorted(np.append(nzi[:, 0], step))
-        # position of step in that table
-        inn = ann.index(step)
-        # total number of points for each range of profile
-        nnz = np.multiply(nzi[:, 1], nzi[:, 2])
-        # now sum to get the start and end indices for the given profile
-        ir0 = np.sum([nnz[0:inn]]) + (step - nzi[inn - 1, 0] - 1) * nzi[inn, 2]
-        ir1 = ir0 + nzi[inn, 2] - 1
-
-        if quant[0] == 'Energy':
-            energy = _calc_energy(data, ir0, ir1)
+    colors = colormap(np.linspace(0, 0.9, len(steps)))
+    plt.gca().set_prop_cycle(cycler('color', list(colors)))
+    # start and end indices of all the profiles
+    prof_start, prof_count = profile_rows(tsteps, data.shape[0])
+    segments = {}
+
+    for iplot, step in enumerate(steps):
+        ir0 = prof_start[step - 1]
+        ir1 = ir0 + prof_count[step - 1] - 1
 
         # Plot the profiles
         if quant[0] == 'Grid' or quant[0] == 'Grid km':
@@ -123,8 +193,8 @@ def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
             axe[0].set_ylabel('z', fontsize=ftsz)
             axe[0].set_xlim([0, len(data[ir0:ir1, 0])])
 
-            dzgrid = (np.array(data[ir0 + 1:ir1, 0], np.float) -
-                      np.array(data[ir0:ir1 - 1, 0], np.float))
+            dzgrid = (np.array(data[ir0 + 1:ir1, 0], float) -
+                      np.array(data[ir0:ir1 - 1, 0], float))
             if quant[0] == 'Grid km':
                 ddim = args.par_nml['geometry']['d_dimensional'] / 1000.
                 axe[1].plot(dzgrid * ddim, '-ko', label='dz')
@@ -136,9 +206,10 @@ def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
             axe[1].set_xlim([0, len(data[ir0:ir1, 0])])
         else:
             if quant[0] == 'Energy':
-                profiles = np.array(np.transpose(energy)[:, [0, 1, 2]],
-                                    float)
-                radius = np.array(np.transpose(energy)[:, 3], float) + rcmb
+                npts = prof_count[step - 1]
+                profiles = np.column_stack(
+                    [flux[iplot, :npts] for flux in energy[:3]])
+                radius = energy[3][iplot, :npts] + rcmb
             else:
                 profiles = np.array(data[ir0:ir1, vartuple], float)
                 radius = np.array(data[ir0:ir1, 0], float) + rcmb
@@ -147,33 +218,27 @@ def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
                     donnee = list(map(integ, profiles[:, i], radius))
                 else:
                     donnee = profiles[:, i]
+                if args.batchplot:
+                    segments.setdefault(i, []).append(
+                        np.column_stack((donnee, radius)))
                 if i == 0:
-                    pplot = plt.plot(donnee, radius, linewidth=lwdth,
-                                     label=fmttime(tsteps[step - 1, 2]))
+                    if args.batchplot:
+                        col = colors[iplot]
+                    else:
+                        pplot = plt.plot(donnee, radius, linewidth=lwdth,
+                                         label=fmttime(tsteps[step - 1, 2]))
 
-                    # get color and size characteristics
-                    col = pplot[0].get_color()
+                        # get color and size characteristics
+                        col = pplot[0].get_color()
 
                     # overturned version of the initial profiles
                     if quant[0] in ('Concentration', 'Temperature') and\
                        (args.plot_overturn_init or args.plot_difference) and\
                        step == istart + 1:
                         rfin = (rmax**3 + rmin**3 - radius**3)**(1 / 3)
-                        if quant[0] == 'Concentration':
-                            conc0 = _extrap(rfin, radius, profiles[:, 0])
-                        if quant[0] == 'Temperature':
-                            temp0 = _extrap(rfin, radius, profiles[:, 0])
                         plt.plot(donnee, rfin, '--', c=col,
                                  linewidth=lwdth, label='Overturned')
 
-                    if quant[0] == 'Concentration' and args.plot_difference:
-                        concd1 = _normprof(radius, profiles[:, 0] - conc0)
-                        concdif.append(concd1)
-                    if quant[0] == 'Temperature' and args.plot_difference:
-                        tempd1 = _normprof(radius, profiles[:, 0] - temp0)
-                        tempdif.append(tempd1)
-                        wmax.append(max(np.array(data[ir0:ir1, 7],
-                                                 np.float)))
                     # plot the overturned version of the initial profiles
                     # if ((quant[0] == 'Concentration' or
                     #      quant[0] == 'Temperature') and
@@ -200,12 +265,25 @@ def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
                                  [radius[0], radius[-1]], "o",
                                  label='StagYY profile ends')
                         plt.xlim([0.9 * donnee[0], 1.2 * donnee[-1]])
-                else:
+                elif not args.batchplot:
                     # additional plots (e. g. min, max)
                     plt.plot(donnee, radius, c=col, dash_capstyle='round',
                              linestyle=linestyles[i], linewidth=lwdth)
                 # change the vertical limits
                 plt.ylim([rmin - 0.05, rmax + 0.05])
+            if args.batchplot and iplot == len(steps) - 1:
+                # all the profiles at once
+                axes = plt.gca()
+                for i, segs in sorted(segments.items()):
+                    label = None
+                    if i == 0:
+                        label = '{} to {}'.format(
+                            fmttime(tsteps[steps[0] - 1, 2]),
+                            fmttime(tsteps[step - 1, 2]))
+                    axes.add_collection(args.mpl.collections.LineCollection(
+                        segs, colors=colors, linewidths=lwdth,
+                        linestyles=linestyles[i], label=label))
+                axes.autoscale_view()
             if len(vartuple) > 1 and step == ilast and quant[0] != 'Viscosity':
                 # legends for the additionnal profiles
                 axes = plt.gca()
@@ -228,10 +306,8 @@ def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
                 plt.ylabel('z', fontsize=ftsz)
                 plt.xticks(fontsize=ftsz)
                 plt.yticks(fontsize=ftsz)
-    if quant[0] == 'Grid':
-        plt.savefig("Grid" + timename + ".pdf", format='PDF')
-    elif quant[0] == 'Grid km':
-        plt.savefig("Gridkm" + timename + ".pdf", format='PDF')
+    if quant[0] == 'Grid' or quant[0] == 'Grid km':
+        plt.savefig(profiles_figname(quant, args), format='PDF')
     else:
         # legend
         lgd = plt.legend(bbox_to_anchor=(0., 1.02, 1., .102), loc=3,
@@ -241,58 +317,24 @@ def plotprofiles(quant, vartuple, data, tsteps, nzi, rbounds, args,
                          handletextpad=0.1, handlelength=1.5,
                          fancybox=True, shadow=False)
 
-        plt.savefig(quant[0].replace(' ', '_') + timename + ".pdf",
-                    format='PDF',
+        plt.savefig(profiles_figname(quant, args), format='PDF',
                     bbox_extra_artists=(lgd, ), bbox_inches='tight')
     plt.close(fig)
-    if args.plot_difference:
-        # plot time series of difference profiles
-        if quant[0] == 'Concentration':
-            iminc = concdif.index(min(concdif))
-            axax[0].semilogy(tsteps[0:ilast:istep, 2], concdif / concdif[0])
-            axax[0].semilogy(tsteps[iminc * istep, 2],
-                             concdif[iminc] / concdif[0],
-                             'o', label=fmttime(tsteps[iminc, 2]))
-            axax[0].set_ylabel('Composition diff.')
-            plt.legend(loc='upper right')
-            return tsteps[iminc * istep, 2], concdif[iminc] / concdif[0],\
-                iminc, timename
-        if quant[0] == 'Temperature':
-            axax[1].semilogy(tsteps[istart:ilast:istep, 2],
-                             tempdif / tempdif[0])
-            imint = tempdif.index(min(tempdif))
-            axax[1].semilogy(tsteps[imint * istep, 2],
-                             tempdif[imint] / tempdif[0],
-                             'o', label=fmttime(tsteps[imint, 2]))
-            axax[1].set_ylabel('Temperature diff.')
-            plt.legend(loc='lower right')
-            # maximum velocity as function of time
-            axax[2].semilogy(tsteps[istart:ilast:istep, 2], wmax)
-            axax[2].set_ylabel('Max. rms vert. velocity')
-            axax[2].set_xlabel('Time')
-            wma = max(wmax)
-            iwm = wmax.index(wma)
-            sigma = math.log(wmax[iwm - 3] / wmax[0]) / tsteps[iwm - 3, 2]
-            expw = [wmax[0] * math.exp(sigma * t)
-                    for t in tsteps[0:iwm + 2:istep, 2]]
-            axax[2].semilogy(tsteps[0:iwm + 2:istep, 2], expw,
-                             linestyle='--', label=r'$sigma=%.2e$' % sigma)
-            plt.legend(loc='upper right')
-            return tsteps[imint * istep, 2], tempdif[imint] / tempdif[0], iwm,\
-                wma, imint, sigma, timename
     return None
 
 
-def plotaveragedprofiles(quant, vartuple, data, tsteps, rbounds, args):
+def plotaveragedprofiles(quant, vartuple, rbounds, args):
     """Plot the time averaged profiles
 
     quant holds the strings for the x axis annotation and
     the legends for the additional profiles
 
     vartuple contains the numbers of the column to be plotted
+
+    profiles are streamed from the rprof file and weighted with time,
+    they are interpolated onto the first grid if it changes
     """
     plt = args.plt
-    istart, ilast, istep = args.timestep
     lwdth = args.linewidth
     ftsz = args.fontsize
     rmin, rmax, rcmb = rbounds
@@ -300,16 +342,10 @@ def plotaveragedprofiles(quant, vartuple, data, tsteps, rbounds, args):
 
     fig, ax = plt.subplots()
 
-    def chunks(mydata, nbz):
-        """Divide vector mydata into array"""
-        return [mydata[ii:ii + nbz] for ii in range(0, len(mydata), nbz)]
-
     # Plot the profiles
-    nztot = int(np.shape(data)[0] / (np.shape(tsteps)[0]))
-    donnee = np.array(data[:, vartuple], float)
-    donnee_chunk = chunks(donnee, nztot)
-    radius = np.array(chunks(np.array(data[:, 0], float) + rcmb, nztot))
-    donnee_averaged = np.mean(donnee_chunk, axis=0)
+    average = RprofAverage().feed(iter_rprof(args, vartuple))
+    radius = (average.zref + rcmb)[np.newaxis, :]
+    donnee_averaged = average.mean
 
     for iid in range(donnee_averaged.shape[1]):
         if len(vartuple) > 1:
@@ -381,8 +417,7 @@ def plotaveragedprofiles(quant, vartuple, data, tsteps, rbounds, args):
         plt.axhline(y=radius[0, myarg]-d_archean, xmin=0, xmax=plt.xlim()[1],
                     color='#7b68ee', alpha=0.2)
 
-    plt.savefig("fig_" + "average" + quant[0].replace(' ', '_') + ".pdf",
-                format='PDF', bbox_inches='tight')
+    plt.savefig(averaged_figname(quant), format='PDF', bbox_inches='tight')
     plt.close(fig)
     return None
 
@@ -432,8 +467,24 @@ def rprof_cmd(args):
                 return xieut
         ctheoarg = ctheoarg[0], initprof
 
-    rprof_data = RprofData(args)
+    rprof_data = load(args, RprofData)
     data, tsteps, nzi = rprof_data.data, rprof_data.tsteps, rprof_data.nzi
+    manifest = Manifest(args, 'rprof')
+    inputs = [misc.stag_file(args, 'rprof.dat')]
+
+    def plot(func, fname, *fargs, **kwargs):
+        """func(*fargs, **kwargs) unless fname is up to date"""
+        if manifest.up_to_date(fname, inputs):
+            return
+        func(*fargs, **kwargs)
+        manifest.record(fname)
+
+    if args.overturn:
+        istart, ilast, istep = args.timestep
+        diag = overturn_diagnostic(rprof_data,
+                                   np.arange(istart, ilast, istep), rbounds)
+        write_overturn(args.outname + '_overturn.dat', diag)
+        return
 
     for var in 'tvunc':  # temp, vertical vel, horizontal vel, viscosity, conc
         meta = constants.RPROF_VAR_LIST[var]
@@ -444,12 +495,8 @@ def rprof_cmd(args):
         if misc.get_arg(args, meta.min_max):
             labels.extend(['Mean', 'Minimum', 'Maximum'])
             cols.extend([meta.prof_idx + 1, meta.prof_idx + 2])
-        out = plotprofiles(labels, cols, data, tsteps, nzi, rbounds,
-                           args, ctheoarg)
-        if var == 't' and args.plot_difference:
-            _, _, _, _, imint, sigma, timename = out
-        if var == 'c' and args.plot_difference:
-            _, _, iminc, timename = out
+        plot(plotprofiles, profiles_figname(labels, args),
+             labels, cols, data, tsteps, nzi, rbounds, args, ctheoarg)
 
     # time averaging and plotting of radial profiles
     for var in 'tvun':  # temperature, vertical vel, horizontal vel, viscosity
@@ -461,9 +508,15 @@ def rprof_cmd(args):
         if misc.get_arg(args, meta.min_max):
             labels.extend(['Mean', 'Minimum', 'Maximum'])
             cols.extend([meta.prof_idx + 1, meta.prof_idx + 2])
-        plotaveragedprofiles(labels, cols, data, tsteps, rbounds, args)
+        plot(plotaveragedprofiles, averaged_figname(labels),
+             labels, cols, rbounds, args)
 
     if args.plot_difference:
+        istart, ilast, istep = args.timestep
+        timename = '{}_{}_{}'.format(istart, ilast - 1, istep)
+        diag = overturn_diagnostic(rprof_data,
+                                   np.arange(istart, ilast, istep), rbounds)
+        plot_overturn(diag, axax)
         args.plt.ticklabel_format(style='sci', axis='x')
         args.plt.savefig('Difference_to_overturned{}.pdf'.format(timename),
                          format='PDF')
@@ -473,29 +526,40 @@ def rprof_cmd(args):
             fich.write(fmt.format('rcmb', 'k_fe', 'ra', 'tminT',
                                   'sigma', 'tminC'))
             fmt = '{:12.5e}' * 6
-            fich.write(fmt.format(rcmb, k_fe, ra0, tsteps[imint, 2],
-                                  sigma, tsteps[iminc, 2]))
+            fich.write(fmt.format(rcmb, k_fe, ra0,
+                                  diag['time'][diag['imint']], diag['sigma'],
+                                  diag['time'][diag['iminc']]))
 
     # Plot grid spacing
     if args.plot_grid:
-        plotprofiles(['Grid'], None, data, tsteps, nzi, rbounds,
-                     args, ctheoarg)
+        quant = ['Grid']
+        plot(plotprofiles, profiles_figname(quant, args),
+             quant, None, data, tsteps, nzi, rbounds, args, ctheoarg)
 
     if args.plot_grid_units:
-        plotprofiles(['Grid km'], None, data, tsteps, nzi, rbounds,
-                     args, ctheoarg)
+        quant = ['Grid km']
+        plot(plotprofiles, profiles_figname(quant, args),
+             quant, None, data, tsteps, nzi, rbounds, args, ctheoarg)
 
     # Plot the profiles of vertical advection: total and contributions from up-
     # and down-welling currents
     if args.plot_advection:
-        plotprofiles(['Advection per unit surface', 'Total', 'down-welling',
-                      'Up-welling'], (57, 58, 59), data, tsteps, nzi,
-                     rbounds, args, ctheoarg)
+        quant = ['Advection per unit surface', 'Total', 'down-welling',
+                 'Up-welling']
+        plot(plotprofiles, profiles_figname(quant, args),
+             quant, (57, 58, 59), data, tsteps, nzi, rbounds, args, ctheoarg)
         if spherical:
-            plotprofiles(['Total scaled advection', 'Total', 'down-welling',
-                          'Up-welling'], (57, 58, 59), data, tsteps, nzi,
-                         rbounds, args, ctheoarg, integrate=True)
-    if args.plot_energy:
-        plotprofiles(['Energy', 'Total', 'Advection',
-                      'conduction'], (57, 58, 59), data, tsteps, nzi,
-                     rbounds, args, ctheoarg, integrate=True)
+            quant = ['Total scaled advection', 'Total', 'down-welling',
+                     'Up-welling']
+            plot(plotprofiles, profiles_figname(quant, args),
+                 quant, (57, 58, 59), data, tsteps, nzi, rbounds, args,
+                 ctheoarg, integrate=True)
+    quant = ['Energy', 'Total', 'Advection', 'conduction']
+    if args.plot_energy and not manifest.up_to_date(
+            profiles_figname(quant, args), inputs):
+        istart, ilast, istep = args.timestep
+        energy = rprof_data.energy(np.arange(istart, ilast, istep))
+        plot(plotprofiles, profiles_figname(quant, args),
+             quant, (57, 58, 59), data, tsteps, nzi, rbounds, args,
+             ctheoarg, integrate=True, energy=energy)
+    manifest.save()
@@ -0,0 +1,254 @@
+"""local server keeping decoded runs in memory
+
+Readers of each run are shared by all the clients through a
+stagdata.StagyyRun, so that a snapshot or a profile file is decoded once
+instead of at each call.  Inputs are read again when their file changes.
+The server listens on localhost, or on a Unix socket with --socket, and
+answers GET requests:
+
+- /field?var=t&step=10: scalar field of a snapshot;
+- /rprof?columns=1,7&steps=0,5: radial profiles (profile, point, column)
+  padded with NaN, all the profiles and columns by default;
+- /time?columns=0,1: time series, all the columns by default;
+- /image?var=t&step=10: png plot of a snapshot, as done by field.
+
+All of them accept path (StagYY run directory, args.path by default) and
+name (generic output file name, read in the par file by default).  Arrays
+are sent as .npy data, i.e. a small header followed by the raw binary
+values, numpy.load reads them from a buffer.
+"""
+
+import http.server
+import io
+import os
+import socketserver
+import stat
+import threading
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from . import constants, misc
+from .batch import analysis_args
+from .field import plot_scalar
+from .stagdata import BinData, RprofData, StagyyRun, TimeData
+
+
+class Run:
+
+    """StagyyRun whose inputs are read again when their file changes"""
+
+    def __init__(self, args, path, name=None):
+        """args are the options of serve
+
+        plots are done with the options of field
+        """
+        self.data = StagyyRun(path, name, args.geometry, args.snapshots,
+                              args.readers)
+        self.args = analysis_args(args, 'field')
+        self.args.path = path
+        self.args.name = self.data.name
+        self.args.par_nml = self.data.par_nml
+        self._mtimes = {}
+        self._lock = threading.Lock()
+
+    def _check(self, fname, cls, *params):
+        """forget cls(*params) if fname changed since it was read"""
+        mtime = os.stat(fname).st_mtime_ns
+        with self._lock:
+            if self._mtimes.get(fname, mtime) != mtime:
+                self.data.cache.forget(cls, *params)
+            self._mtimes[fname] = mtime
+
+    def snapshot(self, var, timestep):
+        """BinData of var at timestep"""
+        fname = constants.FIELD_VAR_LIST[var].par + \
+            misc.INT_FMT.format(timestep)
+        self._check(self.data.filename(fname), BinData, var, timestep)
+        return self.data.snapshot(var, timestep)
+
+    def rprof(self):
+        """RprofData of the run"""
+        self._check(self.data.filename('rprof.dat'), RprofData)
+        return self.data.rprof
+
+    def time(self):
+        """TimeData of the run"""
+        self._check(self.data.filename('time.dat'), TimeData)
+        return self.data.tseries
+
+
+class Runs:
+
+    """runs requested to the server, created on first use"""
+
+    def __init__(self, args):
+        """args are the options of serve"""
+        self.args = args
+        self.render_lock = threading.Lock()  # pyplot is not thread safe
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def get(self, path=None, name=None):
+        """Run in path, args.path by default
+
+        runs are only kept if path contains StagYY output files
+        """
+        key = os.path.abspath(path or self.args.path), name
+        with self._lock:
+            if key not in self._runs:
+                if not os.path.isdir(key[0]):
+                    raise FileNotFoundError(key[0])
+                run = Run(self.args, *key)
+                prefix = run.data.name + '_'
+                if not any(fname.startswith(prefix)
+                           for fname in os.listdir(key[0])):
+                    run.data.cache.close()
+                    raise FileNotFoundError('no output of {} in {}'.format(
+                        run.data.name, key[0]))
+                self._runs[key] = run
+            return self._runs[key]
+
+    def close(self):
+        """forget all runs"""
+        for run in self._runs.values():
+            run.data.cache.close()
+        self._runs.clear()
+
+
+def _ints(query, key):
+    """comma separated list of integers in query, None if absent"""
+    if not query.get(key):
+        return None
+    return [int(val) for val in query[key].split(',')]
+
+
+def _npy(arr):
+    """arr as .npy data"""
+    buf = io.BytesIO()
+    np.save(buf, np.ascontiguousarray(arr), allow_pickle=False)
+    return buf.getvalue(), 'application/octet-stream'
+
+
+def _field(runs, run, query):
+    """scalar field of a snapshot"""
+    var = query['var']
+    stgdat = run.snapshot(var, int(query['step']))
+    return _npy(stgdat.calc_stream() if var == 's' else stgdat.fields[var])
+
+
+def _rprof(runs, run, query):
+    """radial profiles"""
+    rprof = run.rprof()
+    columns = _ints(query, 'columns')
+    if columns is None:
+        columns = list(range(rprof.data.shape[1]))
+    steps = _ints(query, 'steps')
+    if steps is not None:
+        steps = np.array(steps)
+    return _npy(rprof.profiles(columns, steps)[0])
+
+
+def _time(runs, run, query):
+    """time series"""
+    data = run.time().data
+    columns = _ints(query, 'columns')
+    return _npy(data if columns is None else data[:, columns])
+
+
+def _image(runs, run, query):
+    """png plot of a snapshot"""
+    var = query['var']
+    stgdat = run.snapshot(var, int(query['step']))
+    plt = run.args.plt
+    buf = io.BytesIO()
+    with runs.render_lock:
+        fig, _, _ = plot_scalar(run.args, stgdat, var)
+        plt.figure(fig.number)
+        plt.tight_layout()
+        fig.savefig(buf, format='png')
+        plt.close(fig)
+    return buf.getvalue(), 'image/png'
+
+
+REQUESTS = {
+    '/field': _field,
+    '/rprof': _rprof,
+    '/time': _time,
+    '/image': _image,
+}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    """answer GET requests listed in REQUESTS"""
+
+    def address_string(self):
+        """clients of a Unix socket have no address"""
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return 'local'
+
+    def do_GET(self):
+        """send the requested data"""
+        url = urlsplit(self.path)
+        func = REQUESTS.get(url.path)
+        if func is None:
+            self.send_error(404, 'unknown request {}'.format(url.path))
+            return
+        query = {key: vals[-1] for key, vals in parse_qs(url.query).items()}
+        runs = self.server.runs
+        try:
+            run = runs.get(query.pop('path', None), query.pop('name', None))
+            body, ctype = func(runs, run, query)
+        except FileNotFoundError as err:
+            self.send_error(404, 'file not found ({})'.format(err))
+            return
+        except (KeyError, IndexError, ValueError, OSError) as err:
+            self.send_error(400, 'invalid request ({!r})'.format(err))
+            return
+        except Exception as err:  # keep serving other requests
+            self.send_error(500, 'processing failed ({!r})'.format(err))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    """one thread per client"""
+
+    daemon_threads = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    """one thread per client, on a Unix socket"""
+
+    daemon_threads = True
+
+
+def serve_cmd(args):
+    """serve decoded runs until interrupted with Ctrl-C"""
+    if args.socket:
+        if os.path.exists(args.socket):
+            if not stat.S_ISSOCK(os.stat(args.socket).st_mode):
+                misc.stop(args.socket, 'exists and is not a socket')
+            os.remove(args.socket)
+        server = UnixServer(args.socket, Handler)
+        address = args.socket
+    else:
+        server = TCPServer(('127.0.0.1', args.port), Handler)
+        address = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.runs = Runs(args)
+    print('Serving StagYY runs on', address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.runs.close()
+        if args.socket:
+            os.remove(args.socket)
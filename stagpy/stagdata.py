@@ -1,22 +1,47 @@
 """define StagyyData"""
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import os.path
 import re
 import struct
+import threading
 from itertools import zip_longest
 from scipy import integrate
-from . import constants, misc
+from . import constants, misc, parfile, timing
+
+
+def _window_reduce(arr, first, ufunc):
+    """reduce rows first[i] to i of arr with ufunc, for each row i
+
+    a sparse table of reductions over blocks of 2**k rows is built one
+    level at a time, each window is answered with the two blocks of the
+    largest level fitting in it.
+    """
+    length = np.arange(arr.shape[0]) - first + 1
+    level = np.floor(np.log2(length)).astype(int)
+    out = np.empty_like(arr)
+    table = arr
+    width = 1
+    for lvl in range(level.max() + 1):
+        rows = np.nonzero(level == lvl)[0]
+        out[rows] = ufunc(table[first[rows]], table[rows - width + 1])
+        table = ufunc(table[:-width], table[width:])
+        width *= 2
+    return out
 
 
 class BinData:
 
     """reads StagYY binary data and processes them"""
 
-    def __init__(self, args, var, timestep):
+    def __init__(self, args, var, timestep, fields=True):
         """read the necessary binary file
 
         after init, the StagyyData object is ready
-        for processing
+        for processing.  Only the header is read if fields is False,
+        nbytes is then the size the file should have.
         """
         self.args = args
         self.var = var
@@ -29,9 +54,14 @@ class BinData:
         self.fullname = misc.stag_file(args, self.par_type, timestep)
         self.nval = 4 if self.par_type == 'vp' else 1
 
-        with open(self.fullname, 'rb') as self._fid:
-            self._catch_header()
-            self._readfile()
+        with timing.stage('BinData', timestep), \
+                open(self.fullname, 'rb') as self._fid:
+            with timing.stage('header'):
+                self._catch_header()
+            self.nbytes = self._fid.tell() + self._fields_size()
+            if fields:
+                with timing.stage('decode'):
+                    self._readfile()
 
     def _readbin(self, fmt='i', nwords=1):
         """Read n words of 4 or 8 bytes with fmt format.
@@ -95,7 +125,7 @@ class BinData:
         else:
             self.rgeom = np.array(range(0, self.nrtot * 2 + 1))\
                 * 0.5 / self.nrtot
-        self.rgeom.resize((self.nrtot + 1, 2))
+        self.rgeom = np.append(self.rgeom, 0.).reshape(self.nrtot + 1, 2)
 
         if magic >= 7:
             self.rcmb = self._readbin('f')  # radius of the cmb
@@ -139,6 +169,22 @@ class BinData:
         self.y_mesh = self.r_mesh * np.sin(self.ph_mesh) * np.sin(self.th_mesh)
         self.z_mesh = self.r_mesh * np.cos(self.th_mesh)
 
+    def _block_size(self):
+        """number of values in the block of each parallel subdomain"""
+        nth = self.nthtot // self.nnth
+        nph = self.nphtot // self.nnph
+        nrd = self.nrtot // self.nnr
+        nbk = self.nblocks // self.nnb
+        return (nth + self.xyp) * (nph + self.xyp) * nrd * nbk * self.nval
+
+    def _fields_size(self):
+        """number of bytes of the fields following the header"""
+        nwords = self.nnb * self.nnr * self.nnph * self.nnth * \
+            self._block_size()
+        if self.nval > 1:
+            nwords += 1  # scale factor
+        return nwords * (8 if self._64bit else 4)
+
     def _readfile(self):
         """read scalar/vector fields"""
         # compute nth, nph, nr and nb PER CPU
@@ -147,7 +193,7 @@ class BinData:
         nrd = self.nrtot // self.nnr
         nbk = self.nblocks // self.nnb
         # the number of values per 'read' block
-        npi = (nth + self.xyp) * (nph + self.xyp) * nrd * nbk * self.nval
+        npi = self._block_size()
 
         if self.nval > 1:
             self.scalefac = self._readbin('f')
@@ -226,6 +272,33 @@ class BinData:
         return stream
 
 
+def snapshot_complete(args, var, timestep):
+    """whether the binary file of var at timestep is fully written
+
+    its size has to be the one predicted by its header
+    """
+    fname = os.path.join(args.path, '{}_{}{}'.format(
+        args.name, constants.FIELD_VAR_LIST[var].par,
+        misc.INT_FMT.format(timestep)))
+    try:
+        size = os.path.getsize(fname)
+        header = BinData(args, var, timestep, fields=False)
+    except (OSError, struct.error, ValueError):
+        return False
+    return size == header.nbytes
+
+
+def profile_rows(tsteps, nrows):
+    """first row and number of rows of each profile in rprof data
+
+    tsteps holds the line number of each profile header, data rows of
+    profile i start after the i + 1 first headers
+    """
+    start = tsteps[:, 0].astype(int) - np.arange(tsteps.shape[0])
+    count = np.diff(np.append(start, nrows))
+    return start, count
+
+
 class RprofData:
 
     """extract radial profiles data"""
@@ -233,7 +306,8 @@ class RprofData:
     def __init__(self, args):
         """create RprofData object"""
         step_regex = re.compile(r'^\*+step:\s*(\d+) ; time =\s*(\S+)')
-        self._readproffile(args, step_regex)
+        with timing.stage('RprofData'):
+            self._readproffile(args, step_regex)
 
     def _readproffile(self, args, step_regex):
         """extract info from rprof.dat"""
@@ -254,17 +328,6 @@ class RprofData:
         tsteps = np.array(timesteps)
         nsteps = tsteps.shape[0]
         data = np.array(data0)
-        # all the processing of timesteps
-        # should be in commands.*_cmd
-        # instead of main.py
-        # since it could be different between
-        # the different modules
-        istart, ilast, istep = args.timestep
-        if ilast == -1:
-            ilast = nsteps - 1
-        if istart == -1:
-            istart = nsteps - 1
-        args.timestep = istart, ilast, istep
 
         # number of points for each profile
         nzp = []
@@ -287,6 +350,214 @@ class RprofData:
         self.nzi = nzi
         # stores the profile numbers where number points changes,
         # number of profiles with that number of points, and number of points
+        self.prof_start, self.prof_npts = profile_rows(tsteps, data.shape[0])
+
+    def resolve_timesteps(self, args):
+        """replace -1 in args.timestep by the last profile"""
+        # all the processing of timesteps
+        # should be in commands.*_cmd
+        # instead of main.py
+        # since it could be different between
+        # the different modules
+        nsteps = self.tsteps.shape[0]
+        istart, ilast, istep = args.timestep
+        if ilast == -1:
+            ilast = nsteps - 1
+        if istart == -1:
+            istart = nsteps - 1
+        args.timestep = istart, ilast, istep
+
+    def profiles(self, columns, steps=None):
+        """values of some columns for several profiles
+
+        steps are indices of profiles, all of them by default.  Return a 3D
+        array (profile, point, column), shorter profiles are padded with
+        NaN, and the number of points of each profile.
+        """
+        if steps is None:
+            steps = np.arange(self.tsteps.shape[0])
+        npts = self.prof_npts[steps]
+        ipts = np.arange(npts.max())
+        valid = ipts < npts[:, np.newaxis]
+        rows = np.where(valid, self.prof_start[steps, np.newaxis] + ipts, 0)
+        values = self.data[:, columns].astype(float)[rows]
+        values[~valid] = np.nan
+        return values, npts
+
+    def energy(self, steps=None):
+        """conduction and advection heat fluxes
+
+        Fluxes are computed at the interfaces between cells for all the
+        requested profiles (see profiles) at once.  Return qtot, qadv, qcond
+        and the interface positions as 2D arrays (profile, interface).
+        """
+        values, npts = self.profiles([0, 1, 60, 63], steps)
+        rad, temp, adv, zgrid = np.moveaxis(values, 2, 0)
+        # the last point of each profile is only used for boundary values
+        last = npts - 1
+        iprof = np.arange(npts.size)
+        zgrid[iprof, last] = 1.
+        qadv = np.zeros_like(adv)
+        qadv[:, 1:] = adv[:, :-1]
+        qadv[iprof, last] = 0.
+        qcond = np.empty_like(temp)
+        qcond[:, 1:] = (temp[:, :-1] - temp[:, 1:]) / np.diff(rad)
+        qcond[:, 0] = (1. - temp[:, 0]) / rad[:, 0]
+        qcond[iprof, last] = temp[iprof, last] / (1. - rad[iprof, last])
+        qtot = qadv + qcond
+        return qtot, qadv, qcond, zgrid
+
+    def energy_budget(self, steps=None, rcmb=None):
+        """time-integrated energy budget of each layer
+
+        Layers are the cells of the profiles, centred on the radial
+        coordinate and bounded by the bottom (0) and top (1) of the domain
+        as in energy.  The net heat flowing into each layer is integrated
+        over the time span of the requested profiles (trapezoidal rule),
+        and compared with the change of its heat content between the first
+        and last profiles.  Giving rcmb
+        accounts for the spherical geometry by scaling with the area of
+        spheres.  Profiles need to share the same grid.
+
+        Return the integrated net heat flow, the heat content change and
+        the interface positions.
+        """
+        if steps is None:
+            steps = np.arange(self.tsteps.shape[0])
+        steps = np.asarray(steps)
+        if np.any(self.prof_npts[steps] != self.prof_npts[steps[0]]):
+            misc.stop('energy budget needs a constant number of points')
+        qtot = self.energy(steps)[0]
+        values = self.profiles([0, 1], steps)[0]
+        rad = values[0, :, 0]
+        temp = values[:, :-1, 1]
+        # the last point of the profiles only gives the top boundary values
+        zgrid = np.concatenate(([0.], (rad[:-2] + rad[1:-1]) / 2, [1.]))
+        if rcmb is None:
+            area = np.ones_like(zgrid)
+        else:
+            area = ((zgrid + rcmb) / (1. + rcmb))**2
+        flow = qtot * area
+        net = flow[:, :-1] - flow[:, 1:]
+        time = self.tsteps[steps, 2]
+        heat = np.sum((net[1:] + net[:-1]) *
+                      np.diff(time)[:, np.newaxis] / 2, axis=0)
+        thick = np.diff(zgrid)
+        if rcmb is not None:
+            # volume of spherical shells
+            thick = np.diff((zgrid + rcmb)**3) / (3 * (1. + rcmb)**2)
+        storage = (temp[-1] - temp[0]) * thick
+        return heat, storage, zgrid
+
+
+def iter_rprof(args, columns):
+    """iterate through profiles of rprof.dat without storing them
+
+    yield the time step, the time and a 2D array whose columns are the
+    radial coordinate followed by the requested columns
+    """
+    step_regex = re.compile(r'^\*+step:\s*(\d+) ; time =\s*(\S+)')
+    cols = [0] + list(columns)
+    proffile = misc.stag_file(args, 'rprof.dat')
+    header = None
+    rows = []
+    with open(proffile) as stream:
+        for line in stream:
+            if line == '\n':
+                continue
+            if line[0] == '*':
+                if header is not None:
+                    yield header + (np.array(rows)[:, cols],)
+                match = step_regex.match(line)
+                header = int(match.group(1)), float(match.group(2))
+                rows = []
+            else:
+                rows.append(np.array(line.split(), float))
+    if header is not None:
+        yield header + (np.array(rows)[:, cols],)
+
+
+class RprofAverage:
+
+    """time-weighted statistics of radial profiles
+
+    Profiles are added one at a time so that the history never has to be
+    held in memory.  Each profile is interpolated onto the reference grid
+    (by default the grid of the first profile) when the number or the
+    position of points differs.  Profiles are weighted with the time
+    intervals around them (trapezoidal rule), means and variances are
+    updated incrementally.
+    """
+
+    def __init__(self, zref=None):
+        """zref is the optional reference radial grid"""
+        self.zref = zref
+        self.nprofs = 0
+        self.wsum = 0.
+        self.mean = None
+        self._m2 = None
+        self._prev = None
+
+    def _regrid(self, prof):
+        """profile values on the reference grid"""
+        if self.zref is None:
+            self.zref = prof[:, 0].copy()
+        if np.array_equal(prof[:, 0], self.zref):
+            return prof[:, 1:]
+        return np.column_stack([np.interp(self.zref, prof[:, 0], col)
+                                for col in prof[:, 1:].T])
+
+    def _update(self, vals, weight):
+        """weighted incremental update of mean and variance"""
+        self.wsum += weight
+        delta = vals - self.mean
+        self.mean += weight / self.wsum * delta
+        self._m2 += weight * delta * (vals - self.mean)
+
+    def add(self, time, prof):
+        """add profile at a given time
+
+        the first column of prof is the radial coordinate
+        """
+        vals = self._regrid(prof)
+        if self._prev is None:
+            self.mean = vals.astype(float)
+            self._m2 = np.zeros_like(self.mean)
+        else:
+            tprev, vprev = self._prev
+            dtime = (time - tprev) / 2
+            if dtime > 0:
+                self._update(vprev, dtime)
+                self._update(vals, dtime)
+        self._prev = time, vals
+        self.nprofs += 1
+
+    def feed(self, profiles, steps=None, times=None):
+        """add profiles from iter_rprof
+
+        steps and times are optional (first, last) windows, both bounds
+        included, applied respectively to profile indices and to times
+        """
+        for iprof, (_, time, prof) in enumerate(profiles):
+            if steps is not None:
+                if iprof > steps[1]:
+                    break
+                if iprof < steps[0]:
+                    continue
+            if times is not None:
+                if time > times[1]:
+                    break
+                if time < times[0]:
+                    continue
+            self.add(time, prof)
+        return self
+
+    @property
+    def var(self):
+        """weighted variance of profiles"""
+        if self.wsum == 0:
+            return np.zeros_like(self.mean)
+        return self._m2 / self.wsum
 
 
 class TimeData:
@@ -295,6 +566,11 @@ class TimeData:
 
     def __init__(self, args):
         """read temporal series from time.dat"""
+        with timing.stage('TimeData'):
+            self._readtimefile(args)
+
+    def _readtimefile(self, args):
+        """extract info from time.dat"""
         timefile = misc.stag_file(args, 'time.dat')
         with open(timefile, 'r') as infile:
             first = infile.readline()
@@ -315,3 +591,260 @@ class TimeData:
             self.colnames = self.colnames[:28] + self.colnames[30:]
 
         self.data = np.array(list(zip_longest(*data, fillvalue=0))).T
+
+    def rolling(self, window):
+        """rolling statistics over time windows
+
+        For each time step t, statistics are computed over the time interval
+        [t - window, t], truncated at the beginning of the series.  Samples
+        are weighted with time through linear interpolation between them,
+        which is well suited to unevenly spaced time steps.  Means and
+        variances rely on cumulative integrals and all the columns of data
+        are processed at once.
+
+        Return mean, variance, minimum and maximum, 2D arrays with the same
+        shape as data.
+        """
+        data = self.data
+        time = data[:, 1]
+        dtime = np.diff(time)[:, np.newaxis]
+        # cumulative integrals of the interpolated series and its square
+        cum1 = np.zeros(data.shape)
+        cum1[1:] = np.cumsum((data[1:] + data[:-1]) * dtime / 2, axis=0)
+        cum2 = np.zeros(data.shape)
+        cum2[1:] = np.cumsum((data[1:]**2 + data[1:] * data[:-1] +
+                              data[:-1]**2) * dtime / 3, axis=0)
+
+        tbeg = np.maximum(time - window, time[0])
+        first = np.searchsorted(time, tbeg)
+        prev = np.maximum(first - 1, 0)
+        # interpolated value at the beginning of windows
+        dprev = time[first] - time[prev]
+        frac = np.zeros(time.shape)
+        np.divide(time[first] - tbeg, dprev, out=frac, where=dprev > 0)
+        ybeg = data[first] - frac[:, np.newaxis] * (data[first] - data[prev])
+        # integrals over the windows
+        dbeg = (time[first] - tbeg)[:, np.newaxis]
+        int1 = cum1 - cum1[first] + (ybeg + data[first]) * dbeg / 2
+        int2 = cum2 - cum2[first] + (ybeg**2 + ybeg * data[first] +
+                                     data[first]**2) * dbeg / 3
+        span = (time - tbeg)[:, np.newaxis] * np.ones(data.shape)
+        mean = data.copy()
+        np.divide(int1, span, out=mean, where=span > 0)
+        var = np.zeros(data.shape)
+        np.divide(int2, span, out=var, where=span > 0)
+        var = np.maximum(var - mean**2, 0)
+        var[span[:, 0] == 0] = 0
+
+        vmin = np.minimum(_window_reduce(data, first, np.minimum), ybeg)
+        vmax = np.maximum(_window_reduce(data, first, np.maximum), ybeg)
+        return mean, var, vmin, vmax
+
+
+class DataCache:
+
+    """inputs shared by the analyses of a batch
+
+    Inputs are read once by a pool of threads, on demand or ahead of time
+    with prefetch.  Snapshots are keyed by file (the vp fields are read
+    once for all their components) and only the ones of the last
+    nsnaps timesteps are kept.  Methods can be called from several threads
+    (see serve).
+    """
+
+    def __init__(self, args, nthreads=2, nsnaps=2):
+        """args is used for all the readers"""
+        self.args = args
+        self.nsnaps = nsnaps
+        self.snap_vars = {}  # one variable of each snapshot file read
+        self._pool = ThreadPoolExecutor(nthreads)
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(cls, params):
+        """snapshots are identified by file, others by reader"""
+        if cls is BinData:
+            var, timestep = params
+            return constants.FIELD_VAR_LIST[var].par, timestep
+        return (cls.__name__,)
+
+    def prefetch(self, cls, *params):
+        """start reading cls(args, *params) in the background
+
+        return the future of the instance
+        """
+        key = self._key(cls, params)
+        with self._lock:
+            if key in self._futures:
+                return self._futures[key]
+            if cls is BinData:
+                steps = sorted({k[1] for k in self._futures if len(k) == 2} |
+                               {key[1]})
+                for old in list(self._futures):
+                    if len(old) == 2 and old[1] in steps[:-self.nsnaps]:
+                        del self._futures[old]
+            future = self._pool.submit(cls, self.args, *params)
+            self._futures[key] = future
+        return future
+
+    def prefetch_snapshots(self, timestep):
+        """read ahead the snapshot files already read at other steps"""
+        for par_type, var in self.snap_vars.items():
+            fname = os.path.join(self.args.path, '{}_{}{}'.format(
+                self.args.name, par_type, misc.INT_FMT.format(timestep)))
+            if os.path.isfile(fname):
+                self.prefetch(BinData, var, timestep)
+
+    def get(self, cls, *params):
+        """instance of cls(args, *params), read once"""
+        if cls is BinData:
+            self.snap_vars.setdefault(constants.FIELD_VAR_LIST[params[0]].par,
+                                      params[0])
+        return self.prefetch(cls, *params).result()
+
+    def forget(self, cls, *params):
+        """drop cls(args, *params), e.g. when its file has changed"""
+        with self._lock:
+            self._futures.pop(self._key(cls, params), None)
+
+    def clear(self):
+        """forget all inputs"""
+        with self._lock:
+            self._futures.clear()
+
+    def close(self):
+        """wait for pending reads and forget all inputs"""
+        self._pool.shutdown()
+        self.clear()
+
+
+def load(args, cls, *params):
+    """instance of cls(args, *params)
+
+    it is shared with other analyses if args.cache is a DataCache
+    """
+    cache = getattr(args, 'cache', None)
+    if cache is None:
+        data = cls(args, *params)
+    else:
+        data = cache.get(cls, *params)
+    if cls is RprofData:
+        data.resolve_timesteps(args)
+    return data
+
+
+class StagyyRun:
+
+    """StagYY run, for use without the command line interface
+
+    Snapshots, profiles and time series are read on first access and kept
+    in cache (see DataCache), snapshots of the last nsnaps timesteps only.
+    The readers only use the path, name, geometry and par_nml attributes
+    of this object, they never modify it.  It can therefore be shared
+    between threads.
+    """
+
+    def __init__(self, path='./', name=None, geometry='annulus', nsnaps=8,
+                 nthreads=1):
+        """name is read in the par file by default
+
+        nthreads is the number of threads reading files in advance with
+        prefetch
+        """
+        self.path = path
+        self.geometry = geometry
+        self.par_nml = parfile.readpar(self)
+        if name is None:
+            name = self.par_nml['ioin']['output_file_stem']
+        self.name = name
+        self.cache = DataCache(self, nthreads, nsnaps)
+        self._times = {}
+        self._lock = threading.Lock()
+
+    def filename(self, fname):
+        """full name of StagYY out file, raise if it doesn't exist"""
+        fname = os.path.join(self.path, self.name + '_' + fname)
+        if not os.path.isfile(fname):
+            raise FileNotFoundError(fname)
+        return fname
+
+    def timesteps(self, var='t'):
+        """sorted timesteps of the snapshots of var"""
+        par_type = constants.FIELD_VAR_LIST[var].par
+        regex = re.compile(re.escape(self.name + '_' + par_type) +
+                           r'(\d{5})$')
+        return sorted(int(match.group(1)) for match in
+                      map(regex.match, os.listdir(self.path)) if match)
+
+    def snapshot(self, var, timestep):
+        """BinData of var at timestep"""
+        self.filename(constants.FIELD_VAR_LIST[var].par +
+                      misc.INT_FMT.format(timestep))
+        return self.cache.get(BinData, var, timestep)
+
+    def snapshot_time(self, var, timestep):
+        """time of the snapshot of var at timestep, only its header is read"""
+        key = constants.FIELD_VAR_LIST[var].par, timestep
+        with self._lock:
+            if key in self._times:
+                return self._times[key]
+        self.filename(key[0] + misc.INT_FMT.format(timestep))
+        time = BinData(self, var, timestep, fields=False).ti_ad
+        with self._lock:
+            self._times[key] = time
+        return time
+
+    def snapshot_at(self, var, time):
+        """BinData of var closest to time"""
+        steps = self.timesteps(var)
+        if not steps:
+            raise FileNotFoundError('no snapshot of {} in {}'.format(
+                var, self.path))
+        times = np.array([self.snapshot_time(var, step) for step in steps])
+        return self.snapshot(var, steps[np.argmin(np.abs(times - time))])
+
+    @property
+    def rprof(self):
+        """RprofData of the run"""
+        self.filename('rprof.dat')
+        return self.cache.get(RprofData)
+
+    @property
+    def tseries(self):
+        """TimeData of the run"""
+        self.filename('time.dat')
+        return self.cache.get(TimeData)
+
+    def profiles(self, columns, steps=None):
+        """see RprofData.profiles"""
+        return self.rprof.profiles(columns, steps)
+
+    def profile_at(self, columns, time):
+        """values of some columns for the profile closest to time"""
+        rprof = self.rprof
+        istep = np.argmin(np.abs(rprof.tsteps[:, 2] - time))
+        values, npts = rprof.profiles(columns, np.array([istep]))
+        return values[0, :npts[0]]
+
+    def time_series(self, columns=None, tstart=None, tend=None):
+        """time series between tstart and tend, all columns by default"""
+        data = self.tseries.data
+        time = data[:, 1]
+        keep = np.ones(time.shape, dtype=bool)
+        if tstart is not None:
+            keep &= time >= tstart
+        if tend is not None:
+            keep &= time <= tend
+        data = data[keep]
+        return data if columns is None else data[:, columns]
+
+    def prefetch(self, var, timestep):
+        """start reading the snapshot of var at timestep in the background"""
+        self.cache.prefetch(BinData, var, timestep)
+
+    def clear(self):
+        """forget all the data read"""
+        self.cache.clear()
+        with self._lock:
+            self._times.clear()
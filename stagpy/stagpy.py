@@ -5,10 +5,13 @@ Author: Martina Ulvrova
 Date: 2014/12/02
 """
 
-from . import config
+from . import config, timing
 
 
 def main():
     """stagpy entry point"""
     args = config.parse_args()
-    args.func(args)
+    if getattr(args, 'profile', None) is not None:
+        timing.run(args.func, args)
+    else:
+        args.func(args)
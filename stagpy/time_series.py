@@ -5,8 +5,8 @@ Date: 2015/11/27
 """
 
 import numpy as np
-from math import sqrt
-from .stagdata import TimeData
+from . import misc
+from .stagdata import TimeData, load
 
 
 def find_nearest(array, value):
@@ -15,6 +15,59 @@ def find_nearest(array, value):
     return array[idx]
 
 
+def decimate(args, time, series):
+    """reduce the number of points of a time series before plotting
+
+    The series is split in args.npoints / 2 intervals of equal number of
+    points, the minimum and maximum of each interval are kept so that
+    peaks are preserved.  Nothing is done if args.decimate is False or
+    if the series is short enough.
+    """
+    npts = len(series)
+    if not args.decimate or npts <= args.npoints:
+        return time, series
+    nbins = max(args.npoints // 2, 1)
+    binsize = -(-npts // nbins)
+    # pad with last value to have bins of equal size
+    padded = np.append(series, np.repeat(series[-1], nbins * binsize - npts))
+    padded = padded.reshape((nbins, binsize))
+    offsets = np.arange(nbins) * binsize
+    idx = np.concatenate(([0, npts - 1],
+                          offsets + np.argmin(padded, axis=1),
+                          offsets + np.argmax(padded, axis=1)))
+    idx = np.unique(np.minimum(idx, npts - 1))
+    return time[idx], series[idx]
+
+
+def time_averages(time, data):
+    """time weighted mean and rms of each column of data
+
+    data is a 2D array whose rows are at times time, integrals are computed
+    with the trapezoidal rule on all the columns at once.
+    """
+    dtime = np.diff(time)[:, np.newaxis]
+    duration = time[-1] - time[0]
+    mean = np.sum((data[1:] + data[:-1]) * dtime, axis=0) / (2 * duration)
+    dev = (data - mean)**2
+    rms = np.sqrt(np.sum((dev[1:] + dev[:-1]) * dtime, axis=0) /
+                  (2 * duration))
+    return mean, rms
+
+
+def steady_state_start(series):
+    """index from which series is in statistical steady state
+
+    The marginal standard error rule (MSER) is used: the initial transient
+    removed is the one minimizing the standard error of the mean of the
+    remaining samples, searched in the first half of the series.
+    """
+    nrem = np.arange(len(series), 0, -1)
+    sum1 = np.cumsum(series[::-1])[::-1]
+    sum2 = np.cumsum(series[::-1]**2)[::-1]
+    mser = (sum2 / nrem - (sum1 / nrem)**2) / nrem
+    return int(np.argmin(mser[:len(series) // 2 + 1]))
+
+
 def time_cmd(args):
     """plot temporal series"""
     eps = 1.e-10
@@ -27,10 +80,13 @@ def time_cmd(args):
     rah = args.par_nml['refstate']['Rh']
     botpphase = args.par_nml['boundaries']['BotPphase']
 
-    time_data = TimeData(args)
+    time_data = load(args, TimeData)
     colnames, data = time_data.colnames, time_data.data
     ntot = len(data)
 
+    # start of statistics asked by a mouse click only if tstart is not set
+    tstart_set = args.tstart >= 0
+    click_stat = args.clickstat and not tstart_set
     if args.tstart < 0:
         args.tstart = data[0, 1]
 
@@ -71,14 +127,16 @@ def time_cmd(args):
     fig = plt.figure(figsize=(30, 10))
 
     plt.subplot(2, 1, 1)
-    plt.plot(time, ftop, 'b', label='Surface', linewidth=lwdth)
-    plt.plot(time, fbot, 'r', label='Bottom', linewidth=lwdth)
+    plt.plot(*decimate(args, time, ftop), color='b', label='Surface',
+             linewidth=lwdth)
+    plt.plot(*decimate(args, time, fbot), color='r', label='Bottom',
+             linewidth=lwdth)
     if args.energy:
-        plt.plot(time[1:ntot - 2:], ebalance, 'g', label='Energy balance',
-                 linewidth=lwdth)
+        plt.plot(*decimate(args, time[1:ntot - 2:], ebalance), color='g',
+                 label='Energy balance', linewidth=lwdth)
     plt.ylabel('Heat flow', fontsize=ftsz)
-    plt.legend = plt.legend(loc='upper right', shadow=False, fontsize=ftsz)
-    plt.legend.get_frame().set_facecolor('white')
+    lgd = plt.legend(loc='upper right', shadow=False, fontsize=ftsz)
+    lgd.get_frame().set_facecolor('white')
     plt.xticks(fontsize=ftsz)
     plt.yticks(fontsize=ftsz)
     plt.xlim([args.tstart, args.tend])
@@ -90,7 +148,7 @@ def time_cmd(args):
                      arrowprops={'facecolor': 'black'})
 
     plt.subplot(2, 1, 2)
-    plt.plot(time, mtemp, 'k', linewidth=lwdth)
+    plt.plot(*decimate(args, time, mtemp), color='k', linewidth=lwdth)
     plt.xlabel('Time', fontsize=ftsz)
     plt.ylabel('Mean temperature', fontsize=ftsz)
     plt.xticks(fontsize=ftsz)
@@ -103,14 +161,14 @@ def time_cmd(args):
     fig = plt.figure(figsize=(30, 10))
 
     plt.subplot(2, 1, 1)
-    plt.plot(time, vrms, 'g', linewidth=lwdth)
+    plt.plot(*decimate(args, time, vrms), color='g', linewidth=lwdth)
     plt.ylabel(r'$v_{\rm rms}$', fontsize=ftsz)
     plt.xticks(fontsize=ftsz)
     plt.yticks(fontsize=ftsz)
     plt.xlim([args.tstart, args.tend])
 
     plt.subplot(2, 1, 2)
-    plt.plot(time, mtemp, 'k', linewidth=lwdth)
+    plt.plot(*decimate(args, time, mtemp), color='k', linewidth=lwdth)
     plt.xlabel('Time', fontsize=ftsz)
     plt.ylabel('Mean temperature', fontsize=ftsz)
     plt.xticks(fontsize=ftsz)
@@ -122,51 +180,47 @@ def time_cmd(args):
     if not args.compstat:
         return None
 
-    coords = []
-    print('right click to select starting time of statistics computations')
-
-    def onclick(event):
-        """get position and button from mouse click"""
-        ixc, iyc = event.xdata, event.ydata
-        button = event.button
-        # assign global variable to access outside of function
-        if button == 3:
-            coords.append((ixc, iyc))
-            # Disconnect after 1 clicks
-        if len(coords) == 1:
-            fig.canvas.mpl_disconnect(cid)
-            plt.close(1)
-        return
-
-    # Call click func
-    cid = fig.canvas.mpl_connect('button_press_event', onclick)
-    plt.show()
-
-    moy = []
-    rms = []
-    ebal = []
-    rms_ebal = []
-    ch1 = np.where(time == (find_nearest(time, coords[0][0])))
-
-    print('Statistics computed from t =' + str(time[ch1[0][0]]))
-    for num in range(2, len(colnames)):
-        moy.append(np.trapz(data[ch1[0][0]:ntot - 1, num],
-                            x=time[ch1[0][0]:ntot - 1]) /
-                   (time[ntot - 1] - time[ch1[0][0]]))
-        rms.append(sqrt(np.trapz((data[ch1[0][0]:ntot - 1, num] -
-                                  moy[num - 2])**2,
-                                 x=time[ch1[0][0]:ntot - 1]) /
-                        (time[ntot - 1] - time[ch1[0][0]])))
-        print(colnames[num], '=', moy[num - 2], 'pm', rms[num - 2])
-    ebal.append(np.trapz(ebalance[ch1[0][0] - 1:ntot - 3],
-                         x=time[ch1[0][0]:ntot - 2]) /
-                (time[ntot - 2] - time[ch1[0][0]]))
-    rms_ebal.append(sqrt(np.trapz(
-                         (ebalance[ch1[0][0] - 1:ntot - 3] - ebal)**2,
-                         x=time[ch1[0][0]:ntot - 2]) /
-                         (time[ntot - 2] - time[ch1[0][0]])))
+    if click_stat:
+        coords = []
+        print('right click to select starting time of statistics computations')
+
+        def onclick(event):
+            """get position and button from mouse click"""
+            ixc, iyc = event.xdata, event.ydata
+            button = event.button
+            # assign global variable to access outside of function
+            if button == 3:
+                coords.append((ixc, iyc))
+                # Disconnect after 1 clicks
+            if len(coords) == 1:
+                fig.canvas.mpl_disconnect(cid)
+                plt.close(1)
+            return
+
+        # Call click func
+        cid = fig.canvas.mpl_connect('button_press_event', onclick)
+        plt.show()
+        istart = np.argmin(abs(data[:, 1] - coords[0][0]))
+    elif tstart_set:
+        istart = nstart
+    else:
+        # steady state of heat flow, mean temperature and vrms
+        istart = max(steady_state_start(data[:, col]) for col in (2, 5, 8))
+    # energy balance is defined from the second time step
+    istart = max(istart, 1)
+    # energy balance is not defined at the last two time steps
+    if ntot - 2 - istart < 2:
+        misc.stop('not enough time steps to compute statistics,',
+                  'use an earlier tstart')
+
+    print('Statistics computed from t =' + str(data[istart, 1]))
+    moy, rms = time_averages(data[istart:, 1], data[istart:, 2:])
+    for name, mean, dev in zip(colnames[2:], moy, rms):
+        print(name, '=', mean, 'pm', dev)
+    ebal, rms_ebal = time_averages(data[istart:ntot - 2, 1],
+                                   ebalance[istart - 1:, np.newaxis])
     print('Energy balance', ebal, 'pm', rms_ebal)
-    results = moy + ebal + rms + rms_ebal
+    results = np.concatenate((moy, ebal, rms, rms_ebal))
     with open('Stats.dat', 'w') as out_file:
         out_file.write("%10.5e %10.5e %10.5e " % (rab, rah, botpphase))
         for item in results:
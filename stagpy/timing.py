@@ -0,0 +1,148 @@
+"""timing of the main processing stages
+
+Stages are delimited with the stage context manager, which does nothing
+unless timing has been enabled (see run).  Nested stages are recorded
+with their full path, e.g. BinData/decode.  Each thread has its own
+stack of stages.
+"""
+
+from contextlib import contextmanager
+import json
+import sys
+import threading
+import time
+
+_STATE = {'enabled': False, 'records': []}
+_LOCAL = threading.local()
+
+
+def _bytes_read():
+    """number of bytes read by the process so far, None if unknown"""
+    try:
+        with open('/proc/self/io') as fid:
+            for line in fid:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss():
+    """peak resident set size of the process in bytes, None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextmanager
+def stage(name, timestep=None):
+    """record wall time, CPU time and bytes read of a stage
+
+    timestep is inherited from the enclosing stage if not given
+    """
+    if not _STATE['enabled']:
+        yield
+        return
+    if not hasattr(_LOCAL, 'stack'):
+        _LOCAL.stack = []
+    stack = _LOCAL.stack
+    if timestep is None and stack:
+        timestep = stack[-1][1]
+    stack.append((name, timestep))
+    read0 = _bytes_read()
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+        read1 = _bytes_read()
+        _STATE['records'].append({
+            'stage': '/'.join(name for name, _ in stack),
+            'timestep': timestep,
+            'wall': wall,
+            'cpu': cpu,
+            'read': None if read0 is None else read1 - read0,
+            'peak_rss': _peak_rss(),
+        })
+        stack.pop()
+
+
+def summary(records):
+    """aggregate records per stage and per timestep"""
+    stages = {}
+    for rec in records:
+        agg = stages.setdefault(rec['stage'], {
+            'calls': 0, 'wall': 0., 'cpu': 0., 'read': 0, 'peak_rss': 0})
+        agg['calls'] += 1
+        agg['wall'] += rec['wall']
+        agg['cpu'] += rec['cpu']
+        agg['read'] += rec['read'] or 0
+        agg['peak_rss'] = max(agg['peak_rss'], rec['peak_rss'] or 0)
+    steps = {}
+    for rec in records:
+        if rec['timestep'] is None or '/' in rec['stage']:
+            continue
+        agg = steps.setdefault(rec['timestep'], {'wall': 0., 'cpu': 0.,
+                                                 'read': 0})
+        agg['wall'] += rec['wall']
+        agg['cpu'] += rec['cpu']
+        agg['read'] += rec['read'] or 0
+    return stages, steps
+
+
+def print_summary(records, total):
+    """print tables of time spent per stage and per timestep"""
+    stages, steps = summary(records)
+    mega = 2.**20
+    print()
+    print('{:<30}{:>7}{:>10}{:>10}{:>10}{:>10}'.format(
+        'stage', 'calls', 'wall s', 'cpu s', 'read MB', 'rss MB'))
+    for name in sorted(stages):
+        agg = stages[name]
+        print('{:<30}{:>7}{:>10.3f}{:>10.3f}{:>10.1f}{:>10.1f}'.format(
+            name, agg['calls'], agg['wall'], agg['cpu'],
+            agg['read'] / mega, agg['peak_rss'] / mega))
+    print('{:<30}{:>7}{:>10.3f}'.format('total', '', total))
+    if steps:
+        print()
+        print('{:<30}{:>7}{:>10}{:>10}{:>10}'.format(
+            'timestep', '', 'wall s', 'cpu s', 'read MB'))
+        for step in sorted(steps):
+            agg = steps[step]
+            print('{:<30}{:>7}{:>10.3f}{:>10.3f}{:>10.1f}'.format(
+                step, '', agg['wall'], agg['cpu'], agg['read'] / mega))
+
+
+def run(func, args):
+    """run func(args) with timing of stages enabled
+
+    args.profile is an optional output file: stage records are dumped
+    in JSON if its name ends with .json, a .prof file receives cProfile
+    statistics of the whole run.  Stages run in worker processes (see
+    plates jobs) are not recorded.
+    """
+    _STATE['enabled'] = True
+    outfile = args.profile
+    wall0 = time.perf_counter()
+    if outfile.endswith('.prof'):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.runcall(func, args)
+        profiler.dump_stats(outfile)
+    else:
+        func(args)
+    total = time.perf_counter() - wall0
+    _STATE['enabled'] = False
+    records = _STATE['records']
+    print_summary(records, total)
+    if outfile.endswith('.json'):
+        stages, steps = summary(records)
+        with open(outfile, 'w') as fid:
+            json.dump({'total': total, 'stages': stages,
+                       'timesteps': {str(k): v for k, v in steps.items()},
+                       'records': records}, fid, indent=1)
@@ -0,0 +1,70 @@
+"""follow a run while StagYY writes it
+
+With args.watch, field and plates go on processing new snapshots once the
+timestep range is done.  The run directory is polled every args.poll
+seconds, no file system notification library is needed.  A snapshot is
+only processed once its file is as long as its header predicts, which
+avoids reading files StagYY is still writing.
+"""
+
+import os
+import time
+from . import constants, misc
+from .stagdata import snapshot_complete
+
+
+def _file_name(args, par_type, timestep, suffix=''):
+    """base name of a StagYY output file"""
+    return '{}_{}{}{}'.format(args.name, par_type,
+                              misc.INT_FMT.format(timestep), suffix)
+
+
+def ready(args, variables, timestep, listing, others=()):
+    """whether all the files needed at timestep are written
+
+    variables are field variables (see constants.FIELD_VAR_LIST), their
+    binary files have to be as long as their header predicts.  others are
+    (par_type, suffix) of text files, they only have to exist.  listing
+    is the set of files in the run directory.
+    """
+    par_vars = {constants.FIELD_VAR_LIST[var].par: var for var in variables}
+    names = [_file_name(args, par, timestep) for par in par_vars]
+    names.extend(_file_name(args, par, timestep, suffix)
+                 for par, suffix in others)
+    if not all(name in listing for name in names):
+        return False
+    return all(snapshot_complete(args, var, timestep)
+               for var in par_vars.values())
+
+
+def timesteps(args, variables, others=()):
+    """batches of timesteps to process
+
+    The first one is the range args.timestep.  With args.watch, timesteps
+    are rather yielded as soon as their files are written (see ready),
+    starting from the beginning of the range and going on past its end.
+    The run directory is listed once per poll.  Watching ends when
+    Ctrl-C is hit while waiting for new files.
+    """
+    istart, ilast, istep = args.timestep
+    if not args.watch:
+        yield list(range(istart, ilast, istep))
+        return
+    timestep = istart
+    waiting = None
+    while True:
+        listing = set(os.listdir(args.path))
+        batch = []
+        while ready(args, variables, timestep, listing, others):
+            batch.append(timestep)
+            timestep += istep
+        if batch:
+            yield batch
+        else:
+            if waiting != timestep:
+                print('Waiting for timestep', timestep)
+                waiting = timestep
+            try:
+                time.sleep(args.poll)
+            except KeyboardInterrupt:
+                return